@@ -10,38 +10,89 @@
 from optparse import OptionParser
 import copy
 import itertools
+import json
 import logging
 import math
+import multiprocessing
+import os
 import pprint
 import random
 import sys
 
+try:
+    import numpy
+except ImportError:
+    # Only needed for --lockstep
+    numpy = None
+
 from gsp import GSP
 from vcg import VCG
-from history import History
+from history import History, ColumnarHistory, SummaryHistory, SUMMARY_WINDOW
+from market import MarketSnapshot, RoundResult
+from clickmodel import ClickModel, DEFAULT_DROPOFF
 from stats import Stats
+from simcache import SimCache, source_hash
+from profiler import SimProfile, clock, merge_reports, format_report
+from bidclock import BidClock, format_bid_reports
 
 #from bbagent import BBAgent
 #from truthfulagent import TruthfulAgent
 
-from util import argmax_index, shuffled, mean, stddev
+from util import (iround, sample_permutations, RunningStats,
+                  golden_section_max, class_groups, num_assignments,
+                  class_assignments, sample_class_assignments, class_averages)
 
 # Infinite stream of zeros
 zeros = itertools.repeat(0)
 
-def iround(x):
-    """Round x and return an int"""
-    return int(round(x))
+# Fewest iterations --target-ci will stop after
+MIN_CI_ITERS = 5
+
+def notify_observers(observers, t, bids, occupants, slot_clicks,
+                     slot_payments):
+    """Call observe(t, RoundResult) on each of observers, for round t"""
+    public_bids = tuple(bids)
+    slot_clicks = tuple(slot_clicks)
+    slots = dict((id, s) for (s, id) in enumerate(occupants))
+    for a in observers:
+        s = slots.get(a.id)
+        if s is None:
+            result = RoundResult(None, 0, 0, public_bids, slot_clicks)
+        else:
+            result = RoundResult(s, slot_clicks[s], slot_payments[s],
+                                 public_bids, slot_clicks)
+        a.observe(t, result)
 
-def agent_slot(occupants, a_id, t):
-    """Return the slot agent with id a_id occupied in round t,
-    or -1 if a_id wasn't present in round t"""
-    agents = occupants[t]
-    if a_id in agents:
-        return agents.index(a_id)
+def start_mechanism(config):
+    """The mechanism the first round is cleared with"""
+    if (config.mechanism.lower() == 'gsp' or
+        config.mechanism.lower() == 'switch'):
+        return GSP
+    elif config.mechanism.lower() == 'vcg':
+        return VCG
     else:
-        return -1
+        raise ValueError("mechanism must be one of 'gsp', 'vcg', or 'switch'")
 
+def make_history(config, num_slots, agent_ids, click_model):
+    """An empty history of the kind config.history_store asks for"""
+    n = len(agent_ids)
+    if config.history_store == 'columnar':
+        # Preallocated NumPy arrays: rounds x slots and rounds x agents
+        return ColumnarHistory(config.num_rounds, num_slots, agent_ids,
+                               click_model)
+    elif config.history_store == 'lists':
+        # Dictionaries : round # -> per_slot_list_of_whatever
+        return History({}, {}, {}, {}, {}, n, click_model)
+    elif config.history_store == 'summary':
+        # Only the last few rounds (by default the two agents look at),
+        # plus running totals: memory doesn't grow with the number of rounds
+        window = getattr(config, 'history_window', None)
+        if window is None:
+            window = SUMMARY_WINDOW
+        return SummaryHistory(window, n, click_model)
+    else:
+        raise ValueError(
+            "history store must be one of 'lists', 'columnar' or 'summary'")
 
 def sim(config):
     # TODO: Create agents here
@@ -54,118 +105,432 @@ def sim(config):
     by_id = dict((a.id, a) for a in agents)
     agent_ids = [a.id for a in agents]
 
-    if (config.mechanism.lower() == 'gsp' or
-        config.mechanism.lower() == 'switch'):
-        mechanism = GSP
-    elif config.mechanism.lower() == 'vcg':
-        mechanism = VCG
-    else:
-        raise ValueError("mechanism must be one of 'gsp', 'vcg', or 'switch'")
+    mechanism = start_mechanism(config)
 
     reserve = config.reserve
-
-    # Dictionaries : round # -> per_slot_list_of_whatever
-    slot_occupants = {}
-    slot_clicks = {}
-    per_click_payments = {}
-    slot_payments = {}
-    values = {}
-    bids = {}
-
-    history = History(bids, slot_occupants, slot_clicks,
-                      per_click_payments, slot_payments, n)
-
-    def total_spent(agent_id, end):
-        """
-        Compute total amount spent by agent_id through (not including)
-        round end.
-        """
-        s = 0
-        for t in range(end):
-            slot = agent_slot(slot_occupants, agent_id, t)
-            if slot != -1:
-                s += slot_payments[t][slot]
-        return s
-
-    def run_round(top_slot_clicks, t):
-        """ top_slot_clicks is the expected number of clicks in the top slot
-            k is the round number
+    num_slots = max(1, n-1)
+    # Clicks for every slot of every round, shared across simulations
+    click_model = ClickModel.for_config(config, num_slots)
+
+    history = make_history(config, num_slots, agent_ids, click_model)
+
+    # Running total spent by each agent through the last completed round.
+    # Updated once per round when slot_payments is computed, so budget
+    # checks don't have to rescan every earlier round.
+    total_spent = dict(zip(agent_ids, zeros))
+
+    # Agents that want to hear how each round went
+    observers = [a for a in agents if hasattr(a, 'observe')]
+
+    # With --profile, time each phase of every round, and count the calls
+    # agents make to history.round and to copy.  Without it, prof is None
+    # and none of the timing happens.
+    prof = getattr(config, 'profiler', None)
+    if prof is not None:
+        history.round = prof.counting('history.round', history.round)
+        bid_phase = dict((a.id, 'bid/' + a.__class__.__name__) for a in agents)
+
+    # With a bid deadline or time budget, every bid call goes through the
+    # BidClock, which times it and substitutes a fallback bid for late ones
+    bid_clock = getattr(config, 'bid_clock', None)
+
+    # Classes with a bid_batch(ids, values, budgets, t, history, reserve)
+    # static method bid for all their agents in one call, when there's
+    # more than one of them.  (Not when timing bids: deadlines are per
+    # agent.)
+    batch_classes = {}
+    if bid_clock is None:
+        for a in agents:
+            if hasattr(a.__class__, 'bid_batch'):
+                batch_classes.setdefault(a.__class__, []).append(a)
+        for (cls, members) in batch_classes.items():
+            if len(members) < 2:
+                del batch_classes[cls]
+    batched = set(a.id for members in batch_classes.values() for a in members)
+
+    # Agents that bid from a shared MarketSnapshot.  Everyone else just
+    # gets bid(t, history, reserve).  With no such agents the snapshot
+    # isn't built at all.
+    market_bidders = set(a.id for a in agents
+                         if hasattr(a, 'market_bid') and a.id not in batched)
+
+    def run_round(t):
+        """ t is the round number
         """
+        if prof is not None:
+            start = clock()
         if t == 0:
-            bids[t] = [(a.id, a.initial_bid(reserve)) for a in agents]
+            if bid_clock is not None:
+                bids = [(a.id, bid_clock.bid(t, a.id, a.initial_bid, reserve))
+                        for a in agents]
+            else:
+                bids = [(a.id, a.initial_bid(reserve)) for a in agents]
+            if prof is not None:
+                prof.add_time('initial_bids', clock() - start)
         else:
+            # What everyone knows about the last round, computed once and
+            # shared by all agents that take it
+            if market_bidders:
+                market = MarketSnapshot(t, history, reserve, total_spent)
+                if prof is not None:
+                    prof.add_time('market_snapshot', clock() - start)
+            batch_bids = {}
+            for (cls, members) in batch_classes.items():
+                if prof is not None:
+                    start = clock()
+                ids = [a.id for a in members]
+                batch_bids.update(zip(ids, cls.bid_batch(
+                    ids, [a.value for a in members],
+                    [a.budget for a in members], t, history, reserve)))
+                if prof is not None:
+                    prof.add_time('bid/%s (batch)' % cls.__name__,
+                                  clock() - start)
             # Bids from agents with no money get reduced to zero
-            have_money = lambda a: total_spent(a.id, t) < config.budget
-            still_have_money = filter(have_money, agents)
-            current_bids = []
+            bids = []
             for a in agents:
-                b = a.bid(t, history, reserve)
-                if total_spent(a.id, t) < config.budget:
-                    current_bids.append( (a.id, b))
+                if prof is not None:
+                    start = clock()
+                if a.id in batch_bids:
+                    b = batch_bids[a.id]
+                elif bid_clock is not None:
+                    if a.id in market_bidders:
+                        b = bid_clock.bid(t, a.id, a.market_bid,
+                                          t, history, reserve, market)
+                    else:
+                        b = bid_clock.bid(t, a.id, a.bid, t, history, reserve)
+                elif a.id in market_bidders:
+                    b = a.market_bid(t, history, reserve, market)
+                else:
+                    b = a.bid(t, history, reserve)
+                if prof is not None:
+                    if a.id not in batch_bids:
+                        prof.add_time(bid_phase[a.id], clock() - start)
+                    start = clock()
+                if total_spent[a.id] < config.budget:
+                    bids.append( (a.id, b))
                 else:
                     # Out of money: make bid zero.
-                    current_bids.append( (a.id, 0))
-            bids[t] = current_bids
+                    bids.append( (a.id, 0))
+                if prof is not None:
+                    prof.add_time('budget_check', clock() - start)
 
         ##   Ignore those below reserve price
-        active_bidders = len(filter(lambda (i,b): b >= reserve, bids[t]))
+        active_bidders = len(filter(lambda (i,b): b >= reserve, bids))
         #####################################
         ##   1a.   Define no. of slots  (TO-DO: Check what the # of available slots should be)
         #num_slots = max(1, active_bidders-1) 
-        num_slots = max(1, n-1) 
        
         ##   1b.  Calculate clicks/slot
-        slot_clicks[t] = [iround(top_slot_clicks * pow(config.dropoff, i))
-                          for i in range(num_slots)]
+        slot_clicks = list(click_model.clicks(t))
                           
         ##  2. Run mechanism and allocate slots
-        (slot_occupants[t], per_click_payments[t]) = (
-            mechanism.compute(slot_clicks[t],
-                              reserve, bids[t]))
+        if prof is not None:
+            start = clock()
+        (slot_occupants, per_click_payments) = (
+            mechanism.compute(slot_clicks, reserve, bids))
+        if prof is not None:
+            prof.add_time('clearing', clock() - start)
+            start = clock()
         
         ##  3. Define payments
-        slot_payments[t] = map(lambda (x,y): x*y,
-                               zip(slot_clicks[t], per_click_payments[t]))
+        slot_payments = map(lambda (x,y): x*y,
+                            zip(slot_clicks, per_click_payments))
+        for (agent_id, payment) in zip(slot_occupants, slot_payments):
+            if agent_id is not None:
+                total_spent[agent_id] += payment
+        if prof is not None:
+            prof.add_time('payments', clock() - start)
+            start = clock()
                                
         ##  4.  Save utility (misnamed as values)
-        values[t] = dict(zip(agent_ids, zeros))
+        values = dict(zip(agent_ids, zeros))
         
         def agent_value(agent_id, clicks, payment):
             if agent_id is not None:
-                values[t][agent_id] = by_id[agent_id].value * clicks - payment
+                values[agent_id] = by_id[agent_id].value * clicks - payment
             return None
         
-        map(agent_value, slot_occupants[t], slot_clicks[t], slot_payments[t])
+        map(agent_value, slot_occupants, slot_clicks, slot_payments)
+        if prof is not None:
+            prof.add_time('utilities', clock() - start)
+            start = clock()
+
+        ##  5.  Round is over: record it in the history
+        history.record_round(t, bids, slot_occupants, slot_clicks,
+                             per_click_payments, slot_payments)
+        if prof is not None:
+            prof.add_time('record_round', clock() - start)
+
+        ##  6.  Tell the agents that want to know how it went
+        if observers:
+            if prof is not None:
+                start = clock()
+            notify_observers(observers, t, bids, slot_occupants, slot_clicks,
+                             slot_payments)
+            if prof is not None:
+                prof.add_time('observe', clock() - start)
         
         ## Debugging. Set to True to see what's happening.
         log_console = False
         if log_console:
             logging.info("\t=== Round %d ===" % t)
             logging.info("\tnum_slots: %d" % num_slots)
-            logging.info("\tbids: %s" % bids[t])
-            logging.info("\tslot occupants: %s" % slot_occupants[t])
-            logging.info("\tslot_clicks: %s" % slot_clicks[t])
-            logging.info("\tper_click_payments: %s" % per_click_payments[t])
-            logging.info("\tslot_payments: %s" % slot_payments[t])
-            logging.info("\tUtility: %s" % values[t])
-            logging.info("\ttotals spent: %s" % [total_spent(a.id, t+1) for a in agents])
+            logging.info("\tbids: %s" % bids)
+            logging.info("\tslot occupants: %s" % slot_occupants)
+            logging.info("\tslot_clicks: %s" % slot_clicks)
+            logging.info("\tper_click_payments: %s" % per_click_payments)
+            logging.info("\tslot_payments: %s" % slot_payments)
+            logging.info("\tUtility: %s" % values)
+            logging.info("\ttotals spent: %s" % [total_spent[a.id] for a in agents])
             
     
-    for t in range(0, config.num_rounds):
-        # Over 48 rounds, go from 80 to 20 and back to 80.  Mean 50.
-        # Makes sense when 48 rounds, to simulate a day
-        top_slot_clicks = iround(30*math.cos(math.pi*t/24) + 50)
-
-        if t == config.num_rounds / 2 and config.mechanism == 'switch':
-            mechanism = VCG
-        ##   0.  Runs one round
-        run_round(top_slot_clicks, t)
+    # Whatever copy.copy and copy.deepcopy are now, to put back below
+    (real_copy, real_deepcopy) = (copy.copy, copy.deepcopy)
+    try:
+        if prof is not None:
+            # Count copies made anywhere during the simulation.  This swaps
+            # out the copy module's functions for the whole process, so
+            # it's only done here, and undone below however sim exits.
+            copy.copy = prof.counting('copy.copy', real_copy)
+            copy.deepcopy = prof.counting('copy.deepcopy', real_deepcopy)
+            # Report no copies as 0, not as nothing
+            prof.count('copy.copy', 0)
+            prof.count('copy.deepcopy', 0)
+        for t in range(0, config.num_rounds):
+            if t == config.num_rounds / 2 and config.mechanism == 'switch':
+                mechanism = VCG
+            ##   0.  Runs one round
+            run_round(t)
+    finally:
+        (copy.copy, copy.deepcopy) = (real_copy, real_deepcopy)
+        if prof is not None:
+            # Don't leave the counting wrapper on the history
+            del history.round
     
     for a in agents:
-        history.set_agent_spent(a.id, total_spent(a.id, config.num_rounds))
+        history.set_agent_spent(a.id, total_spent[a.id])
     
     return history
 
+def iteration_tasks(i, options, approx, groups):
+    """
+    Draw the values for iteration i, and lazily generate the permutations
+    of them to simulate.  Yields (task for run_task, number of
+    permutations the task stands for).
+    """
+    n = len(options.agent_class_names)
+    values = get_utils(n, options)
+    logging.info("==== Iteration %d / %d.  Values %s ====" % (i, options.iters, values))
+    # Permutations and seeds come from a stream of their own, so the
+    # values drawn next don't depend on how many draws they take (or on
+    # --dedup-perms)
+    rng = random.Random(random.randint(0, sys.maxint))
+
+    ## Create permutations (permutes the random values, and assigns them to agents)
+    if options.dedup_perms:
+        ## Only run one of each set of permutations that differ just by
+        ## swapping values between agents of the same class
+        num_distinct = num_assignments(groups)
+        if not approx:
+            weighted_perms = class_assignments(values, groups)
+        elif num_distinct <= options.max_perms:
+            # Few enough to run them all: each stands for an equal share
+            # of the max_perms samples we'd otherwise take
+            weight = options.max_perms / float(num_distinct)
+            weighted_perms = ((vals, weight) for (vals, _)
+                              in class_assignments(values, groups))
+        else:
+            weighted_perms = ((vals, 1) for vals in sample_class_assignments(
+                values, groups, options.max_perms, rng))
+    else:
+        if approx:
+            perms = sample_permutations(values, options.max_perms,
+                                        options.stratify, rng)
+        else:
+            perms = itertools.permutations(values)
+        weighted_perms = ((vals, 1) for vals in perms)
+
+    for (vals, weight) in weighted_perms:
+        yield ((options, list(vals), rng.randint(0, sys.maxint)), weight)
+
+def ms_to_seconds(ms):
+    if ms is None:
+        return None
+    return ms / 1000.0
+
+def run_task(task):
+    """
+    Run one simulation for a (config, agent_values, seed) task.
+    Returns (per-agent utilities, per-agent spend, total revenue, report),
+    where report is a dict with the SimProfile report under 'profile' if
+    config.profile is set, and the BidClock report under 'bids' if there's
+    a bid deadline or time budget.
+
+    Lives at module level so it can be handed to worker processes.
+    """
+    (config, vals, seed) = task
+    # Leave the caller's random stream alone, so a serial run draws the
+    # same values and seeds as a parallel one
+    caller_state = random.getstate()
+    random.seed(seed)
+    config = copy.copy(config)
+    config.agent_values = vals
+    if config.profile:
+        config.profiler = SimProfile()
+    else:
+        config.profiler = None
+    if config.bid_deadline is not None or config.bid_time_budget is not None:
+        # Both options are in milliseconds
+        config.bid_clock = BidClock(
+            range(len(vals)),
+            deadline=ms_to_seconds(config.bid_deadline),
+            time_budget=ms_to_seconds(config.bid_time_budget),
+            fallback=config.bid_fallback)
+    else:
+        config.bid_clock = None
+    n = len(vals)
+    try:
+        history = sim(config)
+    finally:
+        if config.bid_clock is not None:
+            config.bid_clock.close()
+    stats = Stats(history, dict(zip(range(n), vals)))
+    # Print stats in console?
+    # logging.info(stats)
+    summary = stats.summarize()
+    utils = [summary['utility'][id] for id in range(n)]
+    random.setstate(caller_state)
+    report = {}
+    if config.profiler is not None:
+        report['profile'] = config.profiler.report()
+    if config.bid_clock is not None:
+        report['bids'] = config.bid_clock.report()
+    return (utils, list(history.agents_spent), summary['revenue'], report)
+
+def parse_reserves(spec):
+    """
+    Reserve prices (in cents) for --sweep-reserves: either a list like
+    "0,10,25", or a range "lo:hi:step" (hi included).
+    """
+    if ':' in spec:
+        (lo, hi, step) = map(int, spec.split(':'))
+        if step <= 0:
+            raise ValueError("Bad reserve range step: %s" % spec)
+        return range(lo, hi + 1, step)
+    return [int(r) for r in spec.split(',')]
+
+def reserve_curve(reserves, draws, options, groups, run_all):
+    """
+    Run every draw at every reserve price.  draws is a list of
+    ((options, agent_values, seed) task, weight), shared by all the
+    reserves so they're compared on the same values and random numbers.
+    Returns reserve -> (RunningStats over simulations of daily revenue,
+    list of RunningStats of each agent's daily utility).
+    """
+    n = len(options.agent_class_names)
+    tasks = []
+    for reserve in reserves:
+        config = copy.copy(options)
+        config.reserve = reserve
+        for ((_, vals, seed), weight) in draws:
+            tasks.append((config, vals, seed))
+
+    ##   Runs simulations, for all reserves at once  ###
+    results = run_all(run_task, tasks)
+
+    curve = {}
+    for (r, reserve) in enumerate(reserves):
+        revenue_stats = RunningStats()
+        utility_stats = [RunningStats() for id in range(n)]
+        reserve_results = results[r * len(draws):(r + 1) * len(draws)]
+        for ((_, weight), (utils, spent, revenue, _)) in zip(draws, reserve_results):
+            if options.dedup_perms:
+                utils = class_averages(utils, groups)
+            revenue_stats.add(revenue, weight)
+            for id in range(n):
+                utility_stats[id].add(utils[id], weight)
+        curve[reserve] = (revenue_stats, utility_stats)
+    return curve
+
+def sweep_reserves(options, approx, groups, run_all):
+    """
+    --sweep-reserves and --search-reserve: draw the values and
+    permutations once, then evaluate them at each reserve price, either
+    over a grid or by golden-section search for the revenue maximizing
+    reserve.  Logs the revenue and utility curve over the reserves tried.
+    """
+    draws = []
+    for i in range(options.iters):
+        draws.extend(iteration_tasks(i, options, approx, groups))
+
+    if options.sweep_reserves is not None:
+        curve = reserve_curve(parse_reserves(options.sweep_reserves),
+                              draws, options, groups, run_all)
+    else:
+        (lo, hi) = map(int, options.search_reserve.split(':'))
+        curve = {}
+        def revenue_at(x):
+            reserve = iround(x)
+            if reserve not in curve:
+                ## Each probe runs its simulations in parallel
+                curve.update(reserve_curve([reserve], draws, options,
+                                           groups, run_all))
+            return curve[reserve][0].mean()
+        golden_section_max(revenue_at, lo, hi)
+
+    n = len(options.agent_class_names)
+    logging.info("%s\t\t%s\t\t%s" % ("#" * 15, "RESERVE SWEEP", "#" * 15))
+    logging.warning("Reserve\tRevenue\t(se)\t%s" % "\t".join(
+        "Agent %d" % id for id in range(n)))
+    for reserve in sorted(curve):
+        (revenue_stats, utility_stats) = curve[reserve]
+        logging.warning("$%.2f\t$%.2f\t($%.2f)\t%s" % (
+            0.01 * reserve, 0.01 * revenue_stats.mean(),
+            0.01 * revenue_stats.stderr(),
+            "\t".join("$%.2f" % (0.01 * s.mean()) for s in utility_stats)))
+    best = max(sorted(curve), key=lambda r: curve[r][0].mean())
+    logging.warning("Best reserve: $%.2f (average daily revenue $%.2f)"
+                    % (0.01 * best, 0.01 * curve[best][0].mean()))
+    return curve
+
+## The simulator's own modules.  Changing any of them invalidates every
+## cached result, just like changing an agent's module does for the
+## results that agent was in.
+SIM_MODULES = ['auction', 'lockstep', 'gsp', 'vcg', 'history', 'clickmodel',
+               'market', 'stats', 'util']
+# path -> sha1 of its contents, so each file is only read once per run
+_source_hashes = {}
+
+def _file_hash(path):
+    if path not in _source_hashes:
+        _source_hashes[path] = source_hash(path)
+    return _source_hashes[path]
+
+def task_key(task):
+    """
+    Cache key for a run_task task: everything in the config that sim
+    reads, the values and seed, whether it runs in lockstep (which breaks
+    ties differently), and the source of the simulator and of every agent
+    class taking part.
+    """
+    (config, vals, seed) = task
+    here = os.path.dirname(os.path.abspath(__file__))
+    sim_sources = tuple(_file_hash(os.path.join(here, name + '.py'))
+                        for name in SIM_MODULES)
+    agent_sources = tuple(
+        (name, _file_hash(sys.modules[config.agent_classes[name].__module__].__file__))
+        for name in sorted(set(config.agent_class_names)))
+    if config.click_file is not None:
+        click_source = _file_hash(config.click_file)
+    else:
+        click_source = None
+    return SimCache.key((
+        tuple(config.agent_class_names), tuple(vals), seed,
+        config.budget, config.reserve, config.mechanism, config.num_rounds,
+        config.dropoff, config.click_period, click_source,
+        config.history_store, getattr(config, 'history_window', None),
+        getattr(config, 'lockstep', 1) > 1, sim_sources, agent_sources))
+
 class Params:
     def __init__(self):
         self._init_keys = set(self.__dict__.keys())
@@ -254,7 +619,7 @@ def main(args):
 
     parser.add_option("--mech",
                       dest="mechanism", default="gsp",
-                      help="Set the mechanim: 'gsp' or 'vcg' or 'switch'")
+                      help="Set the mechanim: 'gsp' or 'vcg' or 'switch'.  Give several, e.g. 'gsp,vcg', to run each value draw under all of them with the same random numbers and report the paired differences")
 
     parser.add_option("--num-rounds",
                       dest="num_rounds", default=48, type="int",
@@ -288,6 +653,78 @@ def main(args):
                       dest="seed", default=None, type="int",
                       help="seed for random numbers")
 
+    parser.add_option("--click-period",
+                      dest="click_period", default=48, type="int",
+                      help="Number of rounds in one cycle of the click curve")
+
+    parser.add_option("--click-file",
+                      dest="click_file", default=None,
+                      help="File with the top slot clicks for each round, one per line (overrides --click-period)")
+
+    parser.add_option("--history-store",
+                      dest="history_store", default="lists",
+                      help="Set how sim stores round history: 'lists', 'columnar' (needs numpy), or 'summary' (running totals and the last two rounds only)")
+
+    parser.add_option("--history-window",
+                      dest="history_window", default=None, type="int",
+                      help="Only keep the last K rounds of history, plus running totals of spend, clicks and revenue (implies --history-store summary). The agents here look back two rounds, so K must be at least 2")
+
+    parser.add_option("--stratify",
+                      dest="stratify", default=False, action="store_true",
+                      help="When sampling value permutations, give the top value to each agent equally often (not used with --dedup-perms)")
+
+    parser.add_option("--dedup-perms",
+                      dest="dedup_perms", default=False, action="store_true",
+                      help="Only simulate value permutations that differ by more than swapping values between agents of the same class")
+
+    parser.add_option("--target-ci",
+                      dest="target_ci", default=None, type="float",
+                      help="Stop once the 95% confidence intervals on average daily revenue and every agent's average daily utility are within this many dollars, as are any paired mechanism differences (--iters becomes the maximum)")
+
+    parser.add_option("--sweep-reserves",
+                      dest="sweep_reserves", default=None,
+                      help="Instead of one reserve, run the same value draws at each of these reserves (in cents): a list like '0,10,25' or a range 'lo:hi:step', and log revenue and utility for each")
+
+    parser.add_option("--search-reserve",
+                      dest="search_reserve", default=None,
+                      help="Like --sweep-reserves, but golden-section search 'lo:hi' (in cents) for the reserve with the most revenue")
+
+    parser.add_option("--cache-dir",
+                      dest="cache_dir", default=None,
+                      help="Directory to keep simulation results in, so simulations already run (same agents, agent code, values, and settings) are skipped")
+
+    parser.add_option("--cache-size",
+                      dest="cache_size", default=100, type="int",
+                      help="Max size of --cache-dir, in MB.  The least recently used results are dropped past that")
+
+    parser.add_option("--profile",
+                      dest="profile", default=False, action="store_true",
+                      help="Time each phase of every round (bids per agent class, clearing, payments, utilities, budget checks), count history.round calls and copies, and log a report")
+
+    parser.add_option("--profile-file",
+                      dest="profile_file", default=None,
+                      help="With --profile, also write each simulation's report to this file as JSON")
+
+    parser.add_option("--bid-deadline",
+                      dest="bid_deadline", default=None, type="float",
+                      help="Max CPU time for one bid call, in milliseconds.  Late agents get their --bid-fallback bid instead")
+
+    parser.add_option("--bid-time-budget",
+                      dest="bid_time_budget", default=None, type="float",
+                      help="Max total CPU time for an agent's bid calls over one simulation, in milliseconds.  After that it isn't asked again, and gets its --bid-fallback bid")
+
+    parser.add_option("--bid-fallback",
+                      dest="bid_fallback", default="last",
+                      help="Bid for agents that miss the deadline or run out of time: 'last' (their last bid that was on time) or 'zero'")
+
+    parser.add_option("--lockstep",
+                      dest="lockstep", default=1, type="int",
+                      help="Run this many simulations at a time in lockstep, clearing all their auctions in one vectorized call each round (needs numpy)")
+
+    parser.add_option("--workers",
+                      dest="workers", default=1, type="int",
+                      help="Number of processes to run simulations in")
+
 
     (options, args) = parser.parse_args()
 
@@ -305,16 +742,39 @@ def main(args):
     if options.seed != None:
         random.seed(options.seed)
 
+    if options.bid_fallback not in ('last', 'zero'):
+        usage("--bid-fallback must be 'last' or 'zero'")
+
+    if options.history_window is not None:
+        if options.history_window < 2:
+            usage("--history-window must be at least 2: agents look back two rounds")
+        if options.history_store == 'columnar':
+            usage("--history-window can't be used with --history-store columnar")
+        options.history_store = 'summary'
+
     # Add some more config options
     options.agent_class_names = agents_to_run
     options.agent_classes = load_modules(options.agent_class_names)
-    options.dropoff = 0.75
+    options.dropoff = DEFAULT_DROPOFF
 
     logging.info("Starting simulation...")
     n = len(agents_to_run)
 
-    totals = dict((id, 0) for id in range(n))
-    total_revenues = []
+    ## With several mechanisms (e.g. --mech gsp,vcg), every value draw and
+    ## permutation runs under each of them with the same seed, and we
+    ## report how the later ones differ from the first
+    mechanisms = [mech.lower() for mech in options.mechanism.split(',')]
+    for mech in mechanisms:
+        if mech not in ('gsp', 'vcg', 'switch'):
+            usage("Unknown mechanism: %s" % mech)
+    mech_options = []
+    for mech in mechanisms:
+        mech_config = copy.copy(options)
+        mech_config.mechanism = mech
+        mech_options.append(mech_config)
+    num_mechs = len(mechanisms)
+
+    totals = [dict((id, 0) for id in range(n)) for m in mechanisms]
 
     approx = math.factorial(n) > options.max_perms
     if approx:
@@ -326,52 +786,198 @@ def main(args):
         num_perms = math.factorial(n)
 
     av_value=range(0,n)
-    total_spent = [0 for i in range(n)]
+    total_spent = [[0 for i in range(n)] for m in mechanisms]
+
+    groups = class_groups(agents_to_run)
+    # Running mean and variance, over iterations, of the average daily
+    # revenue and of each agent's average daily utility
+    revenue_stats = [RunningStats() for m in mechanisms]
+    utility_stats = [[RunningStats() for id in range(n)] for m in mechanisms]
+    # Per simulation, how much each later mechanism's revenue and agent
+    # utilities differ from the first mechanism's on the same draw
+    revenue_diffs = [RunningStats() for m in mechanisms[1:]]
+    utility_diffs = [[RunningStats() for id in range(n)] for m in mechanisms[1:]]
+
+    if options.workers > 1:
+        pool = multiprocessing.Pool(options.workers)
+        run_all = pool.map
+    else:
+        pool = None
+        run_all = map
+
+    timing_bids = (options.bid_deadline is not None or
+                   options.bid_time_budget is not None)
+    if options.lockstep > 1:
+        if numpy is None:
+            usage("--lockstep needs numpy")
+        if options.profile or timing_bids:
+            usage("--lockstep can't be used with --profile or bid timing")
+        # Imported here: lockstep builds its simulations with this module
+        from lockstep import lockstep_map
+        run_all = lockstep_map(run_all, options.lockstep)
+    if options.cache_dir is not None and (options.profile or timing_bids):
+        # Cached results would have no timings to report
+        logging.warning("Not using --cache-dir while profiling or timing bids")
+        options.cache_dir = None
+    if options.cache_dir is not None:
+        cache = SimCache(options.cache_dir, options.cache_size * 1024 * 1024)
+        run_all = cache.cached_map(run_all, task_key)
+    else:
+        cache = None
+
+    # Every simulation's report, in task order
+    reports = []
+    if options.profile or timing_bids:
+        run_simulations = run_all
+        def run_all(func, tasks):
+            results = run_simulations(func, tasks)
+            reports.extend(report for (_, _, _, report) in results)
+            return results
+
+    def finish():
+        if pool is not None:
+            pool.close()
+            pool.join()
+        if cache is not None:
+            logging.info("Result cache: %d hits, %d misses" % (cache.hits, cache.misses))
+        if options.profile:
+            profile_reports = [report['profile'] for report in reports]
+            logging.info("%s\t\t%s\t\t%s" % ("#" * 15, "PROFILE", "#" * 15))
+            for line in format_report(merge_reports(profile_reports),
+                                      len(profile_reports)):
+                logging.warning(line)
+            if options.profile_file is not None:
+                f = open(options.profile_file, 'w')
+                json.dump(profile_reports, f, indent=1, sort_keys=True)
+                f.close()
+        if timing_bids:
+            logging.info("%s\t\t%s\t\t%s" % ("#" * 15, "BID TIMES", "#" * 15))
+            for line in format_bid_reports([report['bids'] for report in reports],
+                                           agents_to_run):
+                logging.warning(line)
+
+    if options.sweep_reserves is not None or options.search_reserve is not None:
+        if num_mechs > 1 or options.target_ci is not None:
+            usage("Reserve sweeps take a single --mech, and no --target-ci")
+        sweep_reserves(options, approx, groups, run_all)
+        finish()
+        return
 
     ##  iters = no. of samples to take
-    for i in range(options.iters):
-        values = get_utils(n, options)
-        logging.info("==== Iteration %d / %d.  Values %s ====" % (i, options.iters, values))
-        ## Create permutations (permutes the random values, and assigns them to agents)
-        if approx:
-            perms = [shuffled(values) for i in range(options.max_perms)]
-        else:
-            perms = itertools.permutations(values)
+    ##  Give each simulation its own seed, so results don't depend on
+    ##  whether (or how many) worker processes run them.  With --target-ci,
+    ##  run one iteration at a time so we can stop early; otherwise draw
+    ##  everything up front and run it all at once.
+    if options.target_ci is None:
+        batches = [range(options.iters)]
+    else:
+        batches = ([i] for i in range(options.iters))
+
+    iters_run = 0
+    for batch in batches:
+        tasks = []
+        # For each draw: its iteration, and how many permutations it
+        # stands for
+        task_iters = []
+        weights = []
+        for i in batch:
+            for (task, weight) in iteration_tasks(i, options, approx, groups):
+                (_, vals, seed) = task
+                # One task per mechanism, one after the other
+                for mech_config in mech_options:
+                    tasks.append((mech_config, vals, seed))
+                task_iters.append(i)
+                weights.append(weight)
+
+        ##   Runs simulations  ###
+        results = run_all(run_task, tasks)
+        ###  simulations end.
+
+        ## Reduce in task order, so the sums match a serial run exactly
+        iter_revenues = [dict((i, 0) for i in batch) for m in mechanisms]
+        iter_utils = [dict((i, [0] * n) for i in batch) for m in mechanisms]
+        for (k, (i, weight)) in enumerate(zip(task_iters, weights)):
+            draw_results = results[k * num_mechs:(k + 1) * num_mechs]
+            draw_utils = []
+            for (m, (utils, spent, revenue, _)) in enumerate(draw_results):
+                if options.dedup_perms:
+                    # The task stands for every relabeling of same-class
+                    # agents, so each agent gets its class's average
+                    utils = class_averages(utils, groups)
+                    spent = class_averages(spent, groups)
+                for id in range(n):
+                    totals[m][id] += weight * utils[id]
+                    total_spent[m][id] += weight * spent[id]
+                    iter_utils[m][i][id] += weight * utils[id]
+                iter_revenues[m][i] += weight * revenue
+                draw_utils.append(utils)
+            (_, _, base_revenue, _) = draw_results[0]
+            for m in range(1, num_mechs):
+                (_, _, revenue, _) = draw_results[m]
+                revenue_diffs[m-1].add(revenue - base_revenue, weight)
+                for id in range(n):
+                    utility_diffs[m-1][id].add(
+                        draw_utils[m][id] - draw_utils[0][id], weight)
+        for m in range(num_mechs):
+            for i in batch:
+                revenue_stats[m].add(iter_revenues[m][i] / float(num_perms))
+                for id in range(n):
+                    utility_stats[m][id].add(iter_utils[m][i][id] / float(num_perms))
+        iters_run += len(batch)
+
+        if options.target_ci is not None:
+            # target_ci is in dollars; everything else is in cents
+            tolerance = 100 * options.target_ci
+            all_stats = revenue_stats + revenue_diffs
+            for s in utility_stats + utility_diffs:
+                all_stats.extend(s)
+            widths = [s.ci_halfwidth() for s in all_stats]
+            # A few iterations first, so the variance estimates mean something
+            if iters_run >= MIN_CI_ITERS and max(widths) <= tolerance:
+                logging.info("Stopping after %d iterations: all 95%% confidence "
+                             "intervals are within $%.2f" % (iters_run, options.target_ci))
+                break
+    else:
+        if options.target_ci is not None:
+            logging.warning("Ran all %d iterations without reaching --target-ci $%.2f"
+                            % (iters_run, options.target_ci))
 
-        total_rev = 0
-        ## Iterate over permutations
-        for vals in perms:
-            options.agent_values = list(vals)
-            values = dict(zip(range(n), list(vals)))
-            ##   Runs simulation  ###
-            history = sim(options)
-            ###  simulation ends.
-            stats = Stats(history, values)
-            # Print stats in console?
-            # logging.info(stats)
-            
-            for id in range(n):
-                totals[id] += stats.total_utility(id)
-                total_spent[id] += history.agents_spent[id]
-            total_rev += stats.total_revenue()
-        total_revenues.append(total_rev / float(num_perms))
+    finish()
 
     ## total_spent = total amount of money spent by agents, for all iterations, all permutations, all rounds
     
 
     # Averages are over all the value permutations considered    
-    N = float(num_perms) * options.iters
-    logging.info("%s\t\t%s\t\t%s" % ("#" * 15, "RESULTS", "#" * 15))
-    logging.info("")
-    for a in range(n):
-        logging.info("Stats for Agent %d, %s" % (a, agents_to_run[a]) )
-        logging.info("Average spend $%.2f (daily)" % (0.01 *total_spent[a]/N)  )   
-        logging.info("Average  utility  $%.2f (daily)" % (0.01 * totals[a]/N))
-        logging.info("-" * 40)
-        logging.info("\n")
-    m = mean(total_revenues)
-    std = stddev(total_revenues)
-    logging.warning("Average daily revenue (stddev): $%.2f ($%.2f)" % (0.01 * m, 0.01*std))
+    N = float(num_perms) * iters_run
+    for (m, mech) in enumerate(mechanisms):
+        if num_mechs > 1:
+            logging.info("%s\t\t%s\t\t%s" % ("=" * 15, mech.upper(), "=" * 15))
+        logging.info("%s\t\t%s\t\t%s" % ("#" * 15, "RESULTS", "#" * 15))
+        logging.info("")
+        for a in range(n):
+            logging.info("Stats for Agent %d, %s" % (a, agents_to_run[a]) )
+            logging.info("Average spend $%.2f (daily)" % (0.01 *total_spent[m][a]/N)  )   
+            logging.info("Average  utility  $%.2f (daily)" % (0.01 * totals[m][a]/N))
+            logging.info("-" * 40)
+            logging.info("\n")
+        mean_rev = revenue_stats[m].mean()
+        std = revenue_stats[m].stddev()
+        logging.warning("Average daily revenue (stddev): $%.2f ($%.2f)" % (0.01 * mean_rev, 0.01*std))
+
+    ## Paired differences: standard errors are over simulations, each of
+    ## which ran the same values and seed under every mechanism
+    for m in range(1, num_mechs):
+        logging.info("")
+        logging.warning("Paired difference, %s - %s (standard error), over %d simulations:"
+                        % (mechanisms[m], mechanisms[0], revenue_diffs[m-1].n))
+        logging.warning("  Daily revenue: $%.2f ($%.2f)"
+                        % (0.01 * revenue_diffs[m-1].mean(),
+                           0.01 * revenue_diffs[m-1].stderr()))
+        for a in range(n):
+            logging.warning("  Agent %d, %s, daily utility: $%.2f ($%.2f)"
+                            % (a, agents_to_run[a],
+                               0.01 * utility_diffs[m-1][a].mean(),
+                               0.01 * utility_diffs[m-1][a].stderr()))
 
 #print "config", config.budget
     
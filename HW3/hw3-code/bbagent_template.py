@@ -2,7 +2,7 @@
 
 import sys
 
-from gsp import GSP
+from market import MarketSnapshot
 from util import argmax_index
 
 class BBAgent:
@@ -16,7 +16,7 @@ class BBAgent:
         return self.value / 2
 
 
-    def slot_info(self, t, history, reserve):
+    def slot_info(self, t, history, reserve, market=None):
         """Compute the following for each slot, assuming that everyone else
         keeps their bids constant from the previous rounds.
 
@@ -25,13 +25,16 @@ class BBAgent:
         in the last round.  If slot_id = 0, max_bid is 2* min_bid.
         Otherwise, it's the next highest min_bid (so bidding between min_bid
         and max_bid would result in ending up in that slot)
+
+        market is the round's MarketSnapshot, if the simulator gave us one.
         """
-        prev_round = history.round(t-1)
-        other_bids = filter(lambda (a_id, b): a_id != self.id, prev_round.bids)
+        if market is None:
+            market = MarketSnapshot(t, history, reserve)
+        clicks = market.clicks
+        ranges = market.bid_ranges(self.id)
 
-        clicks = prev_round.clicks
         def compute(s):
-            (min, max) = GSP.bid_range_for_slot(s, clicks, reserve, other_bids)
+            (min, max) = ranges[s]
             if max == None:
                 max = 2 * min
             return (s, min, max)
@@ -41,12 +44,14 @@ class BBAgent:
         return info
 
 
-    def expected_utils(self, t, history, reserve):
+    def expected_utils(self, t, history, reserve, info=None):
         """
         Figure out the expected utility of bidding such that we win each
         slot, assuming that everyone else keeps their bids constant from
         the previous round.
 
+        info is the result of slot_info, if it's already been computed.
+
         returns a list of utilities per slot.
         """
         # TODO: Fill this in
@@ -55,7 +60,7 @@ class BBAgent:
         
         return utilities
 
-    def target_slot(self, t, history, reserve):
+    def target_slot(self, t, history, reserve, market=None):
         """Figure out the best slot to target, assuming that everyone else
         keeps their bids constant from the previous rounds.
 
@@ -63,11 +68,15 @@ class BBAgent:
         the other-agent bid for that slot in the last round.  If slot_id = 0,
         max_bid is min_bid * 2
         """
-        i =  argmax_index(self.expected_utils(t, history, reserve))
-        info = self.slot_info(t, history, reserve)
+        info = self.slot_info(t, history, reserve, market)
+        i =  argmax_index(self.expected_utils(t, history, reserve, info))
         return info[i]
 
     def bid(self, t, history, reserve):
+        return self.market_bid(t, history, reserve,
+                               MarketSnapshot(t, history, reserve))
+
+    def market_bid(self, t, history, reserve, market):
         # The Balanced bidding strategy (BB) is the strategy for a player j that, given
         # bids b_{-j},
         # - targets the slot s*_j which maximizes his utility, that is,
@@ -80,8 +89,8 @@ class BBAgent:
         #        b' = (v_j + p_0(j)) / 2. We can 
         # thus deal with all slots uniformly by defining clicks_{-1} = 2 clicks_0.
         #
-        prev_round = history.round(t-1)
-        (slot, min_bid, max_bid) = self.target_slot(t, history, reserve)
+        prev_round = market.prev_round
+        (slot, min_bid, max_bid) = self.target_slot(t, history, reserve, market)
 
         # TODO: Fill this in.
         bid = 0  # change this
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+import signal
+import time
+
+from util import percentile
+
+# Process CPU time: what an agent's own work costs, not time lost to other
+# processes or the OS
+cpu_clock = time.clock
+
+class BidTimeout(Exception):
+    """Raised inside an agent's bid call when it runs past the deadline"""
+    pass
+
+def _timeout(signum, frame):
+    raise BidTimeout()
+
+class BidClock:
+    """
+    Times every bid call the simulator makes, charging the CPU time it
+    takes to the agent that made it.
+
+      deadline: max CPU seconds for one call, or None.  A call that uses
+          more is late, and its bid is thrown away.  Where the platform has
+          interval timers (Unix), a call still running INTERRUPT_GRACE
+          seconds of wall clock time past the deadline is also
+          interrupted, so a runaway agent can't hold up the simulation,
+          but one that was only waiting for the CPU isn't cut off.
+          (That's the only thing measured in wall clock time: CPU time
+          interval timers make Linux's process CPU clock tick-granular,
+          which would charge agents whole ticks.)
+      time_budget: max total CPU seconds an agent can spend bidding over
+          one simulation, or None.  Once it's used up, the agent isn't called
+          again, and just gets its fallback bid.
+      fallback: what an agent bids when it misses the deadline or is out
+          of time: 'last' (its last bid that was on time) or 'zero'.
+    """
+    INTERRUPT_GRACE = 0.1
+
+    def __init__(self, agent_ids, deadline=None, time_budget=None,
+                 fallback='last'):
+        if fallback not in ('last', 'zero'):
+            raise ValueError("fallback must be 'last' or 'zero'")
+        self.deadline = deadline
+        self.time_budget = time_budget
+        self.fallback = fallback
+        self.last_bid = dict((id, 0) for id in agent_ids)
+        # agent id -> seconds taken by each call
+        self.call_times = dict((id, []) for id in agent_ids)
+        self.time_used = dict((id, 0.0) for id in agent_ids)
+        self.timeouts = dict((id, 0) for id in agent_ids)
+        # agent id -> the round its time budget ran out in, if it did
+        self.exhausted = {}
+        self._old_handler = None
+        if deadline is not None and hasattr(signal, 'setitimer'):
+            try:
+                self._old_handler = signal.signal(signal.SIGALRM, _timeout)
+                self._interrupt = True
+            except ValueError:
+                # Not the main thread: can't take signals here
+                self._interrupt = False
+        else:
+            self._interrupt = False
+
+    def bid(self, t, agent_id, func, *args):
+        """Call func(*args) for agent_id's bid in round t, within the
+        limits.  Returns the bid to use."""
+        if agent_id in self.exhausted:
+            return self._fallback(agent_id)
+        late = False
+        # Only the call itself is charged, not setting the timer
+        start = end = None
+        try:
+            try:
+                if self._interrupt:
+                    signal.setitimer(signal.ITIMER_REAL,
+                                     self.deadline + self.INTERRUPT_GRACE)
+                start = cpu_clock()
+                b = func(*args)
+                end = cpu_clock()
+            finally:
+                if end is None:
+                    end = cpu_clock()
+                if self._interrupt:
+                    signal.setitimer(signal.ITIMER_REAL, 0)
+        except BidTimeout:
+            late = True
+        if start is None:
+            # Interrupted before the call started
+            start = end
+        elapsed = end - start
+
+        self.call_times[agent_id].append(elapsed)
+        self.time_used[agent_id] += elapsed
+        if self.time_budget is not None and self.time_used[agent_id] > self.time_budget:
+            self.exhausted[agent_id] = t
+        if late or (self.deadline is not None and elapsed > self.deadline):
+            self.timeouts[agent_id] += 1
+            return self._fallback(agent_id)
+        self.last_bid[agent_id] = b
+        return b
+
+    def _fallback(self, agent_id):
+        if self.fallback == 'last':
+            return self.last_bid[agent_id]
+        return 0
+
+    def close(self):
+        """Put back whatever SIGALRM handler there was before"""
+        if self._interrupt:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, self._old_handler)
+            self._interrupt = False
+
+    def report(self):
+        """A plain dict of the per-call times, timeouts, total time used,
+        and the rounds agents ran out of time in"""
+        return {'call_times': self.call_times,
+                'timeouts': self.timeouts,
+                'time_used': self.time_used,
+                'exhausted': self.exhausted}
+
+def format_bid_reports(reports, class_names):
+    """
+    Lines of a table of each agent's bid call CPU time percentiles (in
+    milliseconds), missed deadlines, and how many of the simulations
+    (reports) it ran out of time in.
+    """
+    lines = ["%-5s %-14s %8s %8s %8s %8s %8s %9s %11s" % (
+        "agent", "class", "calls", "p50 ms", "p90 ms", "p99 ms", "max ms",
+        "timeouts", "out of time")]
+    for (id, name) in enumerate(class_names):
+        times = sorted(x for r in reports for x in r['call_times'][id])
+        timeouts = sum(r['timeouts'][id] for r in reports)
+        exhausted = len([r for r in reports if id in r['exhausted']])
+        lines.append("%-5d %-14s %8d %8.3f %8.3f %8.3f %8.3f %9d %11d" % (
+            id, name, len(times),
+            1000 * percentile(times, 50), 1000 * percentile(times, 90),
+            1000 * percentile(times, 99), 1000 * percentile(times, 100),
+            timeouts, exhausted))
+    return lines
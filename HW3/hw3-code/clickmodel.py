@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+
+import math
+from collections import OrderedDict
+
+from util import iround
+
+# How much each slot's clicks drop from the slot above, unless a config
+# says otherwise
+DEFAULT_DROPOFF = 0.75
+
+class ClickModel:
+    """
+    The expected number of clicks in every slot of every round, computed
+    once.  Slot i gets iround(top_slot_clicks[t] * dropoff**i) clicks in
+    round t.
+
+    Agents can find the model the simulator is using as history.click_model.
+    """
+    # (click_file, period, num_rounds, num_slots, dropoff) -> ClickModel,
+    # so we only build the table once per config, not once per simulation.
+    # Least recently used first; sweeps over many configs only keep the
+    # last CACHE_SIZE.
+    _cache = OrderedDict()
+    CACHE_SIZE = 16
+
+    def __init__(self, top_slot_clicks, num_slots, dropoff):
+        """top_slot_clicks is a list with the clicks in the top slot for
+        each round."""
+        self.num_rounds = len(top_slot_clicks)
+        self.num_slots = num_slots
+        self.dropoff = dropoff
+        self.table = tuple(
+            tuple(iround(top * pow(dropoff, i)) for i in range(num_slots))
+            for top in top_slot_clicks)
+        self.round_totals = tuple(sum(row) for row in self.table)
+        self.total = sum(self.round_totals)
+
+    @staticmethod
+    def diurnal(num_rounds, num_slots, dropoff, period=48,
+                mean=50, amplitude=30):
+        """
+        Over each period, the top slot goes from mean + amplitude clicks
+        down to mean - amplitude and back.  With the defaults, 48 rounds go
+        from 80 to 20 and back to 80, to simulate a day.
+        """
+        half = period / 2.0
+        top = [iround(amplitude*math.cos(math.pi*t/half) + mean)
+               for t in range(num_rounds)]
+        return ClickModel(top, num_slots, dropoff)
+
+    @staticmethod
+    def from_file(path, num_rounds, num_slots, dropoff):
+        """
+        Read the top slot clicks for each round from a file, one number per
+        line (blank lines and lines starting with # are skipped).
+        """
+        top = []
+        for line in open(path):
+            line = line.strip()
+            if line and not line.startswith('#'):
+                top.append(float(line))
+        if len(top) < num_rounds:
+            raise ValueError("%s has clicks for %d rounds, need %d"
+                             % (path, len(top), num_rounds))
+        return ClickModel(top[:num_rounds], num_slots, dropoff)
+
+    @staticmethod
+    def for_config(config, num_slots):
+        """Return the (cached) model for a simulator config."""
+        key = (config.click_file, config.click_period, config.num_rounds,
+               num_slots, config.dropoff)
+        model = ClickModel._cache.pop(key, None)
+        if model is None:
+            if config.click_file is not None:
+                model = ClickModel.from_file(config.click_file,
+                                             config.num_rounds,
+                                             num_slots, config.dropoff)
+            else:
+                model = ClickModel.diurnal(config.num_rounds, num_slots,
+                                           config.dropoff,
+                                           period=config.click_period)
+            if len(ClickModel._cache) >= ClickModel.CACHE_SIZE:
+                ClickModel._cache.popitem(last=False)
+        ClickModel._cache[key] = model
+        return model
+
+    def clicks(self, t):
+        """Clicks for each slot in round t"""
+        return self.table[t]
+
+    def slot_clicks(self, t, slot):
+        return self.table[t][slot]
+
+    def round_clicks(self, t):
+        """Total clicks over all slots in round t"""
+        return self.round_totals[t]
+
+    def total_clicks(self):
+        """Total clicks over all slots and rounds"""
+        return self.total
+
+    def __repr__(self):
+        return "ClickModel(%d rounds, %d slots, dropoff %s)" % (
+            self.num_rounds, self.num_slots, self.dropoff)
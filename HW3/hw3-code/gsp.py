@@ -1,7 +1,16 @@
 #!/usr/bin/env python
 
+import heapq
 import random
 
+try:
+    import numpy
+except ImportError:
+    # Only needed for compute_batch
+    numpy = None
+
+from util import FrozenDict
+
 class GSP:
     """
     Implements the generalized second price auction mechanism.
@@ -23,16 +32,10 @@ class GSP:
             (in order)
          - per_click_payments is the corresponding payments.
         """
-        valid = lambda (a, bid): bid >= reserve
-        valid_bids = filter(valid, bids)
-
-        rev_cmp_bids = lambda (a1, b1), (a2, b2): cmp(b2, b1)
-        # shuffle first to make sure we don't have any bias for lower or
-        # higher ids
-        random.shuffle(valid_bids)
-        valid_bids.sort(rev_cmp_bids)
-
         num_slots = len(slot_clicks)
+        # Only the top num_slots + 1 bids matter: the winners, and the
+        # first loser, who may set the last price.
+        valid_bids = GSP._top_bids(num_slots + 1, reserve, bids)
         allocated_bids = valid_bids[:num_slots]
         if len(allocated_bids) == 0:
             return ([], [])
@@ -50,6 +53,82 @@ class GSP:
         per_click_payments.append(last_payment)
         return (list(allocation), per_click_payments)
 
+    @staticmethod
+    def _top_bids(k, reserve, bids):
+        """
+        Return the (up to) k highest bids that are at least reserve, highest
+        first, as (id, bid) tuples.  Ties are broken uniformly at random, so
+        there is no bias for lower or higher ids.
+
+        Uses a bounded heap instead of sorting all the bids: O(n log k).
+        """
+        keyed = [(-bid, random.random(), a, bid)
+                 for (a, bid) in bids if bid >= reserve]
+        return [(a, bid) for (_, _, a, bid) in heapq.nsmallest(k, keyed)]
+
+    @staticmethod
+    def compute_batch(slot_clicks, reserve, bids, rng=None):
+        """
+        Clear many auctions at once.  bids is a 2-D array
+        (auctions x bidders) of bids; column j is bidder j in every auction.
+        Same rules as compute, including uniform random tie-breaking, which
+        draws from rng (a numpy RandomState; defaults to numpy.random).
+
+        Returns a pair of (auctions x len(slot_clicks)) arrays
+        (allocation, per_click_payments):
+         - allocation holds the column of the bidder in each slot, or -1
+            if the slot is empty
+         - per_click_payments is the corresponding payments (0 for empty
+            slots).
+        """
+        (allocation, next_bids) = GSP._rank_batch(
+            len(slot_clicks), reserve, bids, rng)
+        # Each pays the bid below them, or the reserve
+        per_click_payments = numpy.where(allocation >= 0, next_bids, 0)
+        return (allocation, per_click_payments)
+
+    @staticmethod
+    def _rank_batch(num_slots, reserve, bids, rng=None):
+        """
+        Shared allocation step for compute_batch (GSP and VCG).
+        Returns (allocation, next_bids), both (auctions x num_slots):
+        next_bids[:, k] is the bid of whoever ranked just below slot k, or
+        the reserve if there is no such valid bid.
+        """
+        if numpy is None:
+            raise ImportError("compute_batch requires numpy")
+        if rng is None:
+            rng = numpy.random
+        bids = numpy.atleast_2d(numpy.asarray(bids))
+        (num_auctions, num_bidders) = bids.shape
+
+        # Rank by bid, highest first, breaking ties with a random key.
+        # Bids below the reserve sort last and are masked out below.
+        valid = bids >= reserve
+        keys = numpy.where(valid, -bids.astype(float), numpy.inf)
+        order = numpy.lexsort((rng.random_sample(bids.shape), keys), axis=1)
+
+        # Pad to num_slots + 1 ranks so every slot has a "next" bidder
+        width = num_slots + 1
+        if num_bidders < width:
+            pad = numpy.zeros((num_auctions, width - num_bidders), dtype=int)
+            order = numpy.hstack([order[:, :num_bidders], pad])
+            pad_valid = numpy.zeros((num_auctions, width), dtype=bool)
+            pad_valid[:, :num_bidders] = True
+        else:
+            order = order[:, :width]
+            pad_valid = numpy.ones((num_auctions, width), dtype=bool)
+
+        rows = numpy.arange(num_auctions)[:, None]
+        ranked_bids = bids[rows, order]
+        ranked_valid = valid[rows, order] & pad_valid
+
+        allocation = numpy.where(ranked_valid[:, :num_slots],
+                                 order[:, :num_slots], -1)
+        next_bids = numpy.where(ranked_valid[:, 1:],
+                                ranked_bids[:, 1:], reserve)
+        return (allocation, next_bids)
+
     @staticmethod
     def bid_range_for_slot(slot, slot_clicks, reserve, bids):
         """
@@ -58,20 +137,57 @@ class GSP:
         Returns a tuple (min_bid, max_bid).
         If slot == 0, returns None for max_bid, since it's not well defined.
         """
-        bid_amounts = [b for (_, b) in bids if b >= reserve]
-        bid_amounts.sort()
-        bid_amounts.reverse()
+        return SlotPriceIndex(reserve, bids).bid_range(slot)
+
+
+class SlotPriceIndex:
+    """
+    The bids from one round, ranked once, so that the bid range for any
+    slot (see GSP.bid_range_for_slot) can be looked up without filtering
+    and sorting the bids again, with or without a given agent's own bid.
+    """
+    def __init__(self, reserve, bids):
+        ranked = [(a, b) for (a, b) in bids if b >= reserve]
+        ranked.sort(key=lambda (a, b): b, reverse=True)
+        # One index is shared by every agent, so none of it can change
+        d = self.__dict__
+        d['reserve'] = reserve
+        # bid amounts, highest first, and agent id -> position in amounts
+        d['amounts'] = tuple(b for (_, b) in ranked)
+        d['rank'] = FrozenDict((a, i) for (i, (a, _)) in enumerate(ranked))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("SlotPriceIndex is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError("SlotPriceIndex is read-only")
+
+    def bid_range(self, slot, exclude=None):
+        """
+        Return (min_bid, max_bid) for slot, as GSP.bid_range_for_slot does.
+        If exclude is an agent id, that agent's bid is left out, as if it
+        had been filtered out of the bids.  O(1).
+        """
+        amounts = self.amounts
+        # Positions at or past skip are shifted up by one to step over
+        # the excluded bid.
+        skip = self.rank.get(exclude, len(amounts))
+        n = len(amounts) - (1 if skip < len(amounts) else 0)
+        def amount(j):
+            return amounts[j] if j < skip else amounts[j+1]
 
-        n = len(bid_amounts)
         if slot >= n:
             # More than reserve, less than smallest bid
             if n > 0:
-                max_bid = bid_amounts[-1]
+                max_bid = amount(n-1)
             else:
-                max_bid = reserve if slot > 0 else None
-            return (reserve, max_bid)
-        
-        min_bid = bid_amounts[slot]
-        max_bid = bid_amounts[slot-1] if slot > 0 else None
+                max_bid = self.reserve if slot > 0 else None
+            return (self.reserve, max_bid)
+
+        min_bid = amount(slot)
+        max_bid = amount(slot-1) if slot > 0 else None
         return (min_bid, max_bid)
 
+    def bid_ranges(self, num_slots, exclude=None):
+        """List of bid_range(slot, exclude) for every slot.  O(num_slots)."""
+        return [self.bid_range(s, exclude) for s in range(num_slots)]
@@ -2,8 +2,15 @@
 
 import sys
 import math
+
+try:
+    import numpy
+except ImportError:
+    # Only needed for bid_many
+    numpy = None
+
 from auction import iround
-from gsp import GSP
+from market import MarketSnapshot
 from util import argmax_index
 
 class HHAWbb:
@@ -17,7 +24,7 @@ class HHAWbb:
         return self.value / 2
 
 
-    def slot_info(self, t, history, reserve):
+    def slot_info(self, t, history, reserve, market=None):
         """Compute the following for each slot, assuming that everyone else
         keeps their bids constant from the previous rounds.
 
@@ -26,13 +33,16 @@ class HHAWbb:
         in the last round.  If slot_id = 0, max_bid is 2* min_bid.
         Otherwise, it's the next highest min_bid (so bidding between min_bid
         and max_bid would result in ending up in that slot)
+
+        market is the round's MarketSnapshot, if the simulator gave us one.
         """
-        prev_round = history.round(t-1)
-        other_bids = filter(lambda (a_id, b): a_id != self.id, prev_round.bids)
+        if market is None:
+            market = MarketSnapshot(t, history, reserve)
+        clicks = market.clicks
+        ranges = market.bid_ranges(self.id)
 
-        clicks = prev_round.clicks
         def compute(s):
-            (min, max) = GSP.bid_range_for_slot(s, clicks, reserve, other_bids)
+            (min, max) = ranges[s]
             if max == None:
                 max = 2 * min
             return (s, min, max)
@@ -42,19 +52,22 @@ class HHAWbb:
         return info
 
 
-    def expected_utils(self, t, history, reserve):
+    def expected_utils(self, t, history, reserve, info=None):
         """
         Figure out the expected utility of bidding such that we win each
         slot, assuming that everyone else keeps their bids constant from
         the previous round.
 
+        info is the result of slot_info, if it's already been computed.
+
         returns a list of utilities per slot.
         """
         # TODO: Fill this in
         clicks = history.round(t-1).clicks
         utilities = [0.0]*(len(clicks))   # Change this
 
-        info = self.slot_info(t, history, reserve)
+        if info is None:
+            info = self.slot_info(t, history, reserve)
 
         for i in xrange(len(clicks)):
             s_k = clicks[i]
@@ -62,7 +75,7 @@ class HHAWbb:
         
         return utilities
 
-    def target_slot(self, t, history, reserve):
+    def target_slot(self, t, history, reserve, market=None):
         """Figure out the best slot to target, assuming that everyone else
         keeps their bids constant from the previous rounds.
 
@@ -70,11 +83,15 @@ class HHAWbb:
         the other-agent bid for that slot in the last round.  If slot_id = 0,
         max_bid is min_bid * 2
         """
-        i =  argmax_index(self.expected_utils(t, history, reserve))
-        info = self.slot_info(t, history, reserve)
+        info = self.slot_info(t, history, reserve, market)
+        i =  argmax_index(self.expected_utils(t, history, reserve, info))
         return info[i]
 
     def bid(self, t, history, reserve):
+        return self.market_bid(t, history, reserve,
+                               MarketSnapshot(t, history, reserve))
+
+    def market_bid(self, t, history, reserve, market):
         # The Balanced bidding strategy (BB) is the strategy for a player j that, given
         # bids b_{-j},
         # - targets the slot s*_j which maximizes his utility, that is,
@@ -87,8 +104,8 @@ class HHAWbb:
         #        b' = (v_j + p_0(j)) / 2. We can 
         # thus deal with all slots uniformly by defining clicks_{-1} = 2 clicks_0.
         #
-        prev_round = history.round(t-1)
-        (slot, min_bid, max_bid) = self.target_slot(t, history, reserve)
+        prev_round = market.prev_round
+        (slot, min_bid, max_bid) = self.target_slot(t, history, reserve, market)
 
         # TODO: Fill this in.
         bid = 0  # change this
@@ -102,6 +119,79 @@ class HHAWbb:
 
         return bid
 
+    @staticmethod
+    def bid_batch(ids, values, budgets, t, history, reserve):
+        """
+        market_bid for several agents in the same auction at once, with
+        the given ids and values: the last round is looked up and ranked
+        only once.  Budgets don't matter to this strategy.
+        """
+        prev_round = history.round(t-1)
+        if numpy is not None and all(isinstance(b, (int, long))
+                                     for (_, b) in prev_round.bids):
+            # Bids by id; ids nobody has get a bid below the reserve
+            row = [reserve - 1] * (max(a for (a, _) in prev_round.bids) + 1)
+            for (a, b) in prev_round.bids:
+                row[a] = b
+            return HHAWbb._balanced_bids(
+                ids, values, numpy.array([row] * len(ids)),
+                prev_round.clicks, reserve)
+        # Fractional bids: the same thing one at a time, so the arithmetic
+        # (int or float) is exactly market_bid's
+        market = MarketSnapshot(t, history, reserve)
+        return [HHAWbb(id, value, budget).market_bid(t, history, reserve, market)
+                for (id, value, budget) in zip(ids, values, budgets)]
+
+    @staticmethod
+    def bid_many(agents, sims, t, histories, reserve, prev_bids):
+        """
+        market_bid for many agents at once (see lockstep.sim_lockstep):
+        agents[j] is in simulation sims[j], whose last round's bids are
+        row sims[j] of prev_bids.
+        """
+        if numpy is None or prev_bids.dtype.kind not in 'iu':
+            return [a.market_bid(t, histories[k], reserve,
+                                 MarketSnapshot(t, histories[k], reserve))
+                    for (a, k) in zip(agents, sims)]
+        return HHAWbb._balanced_bids(
+            [a.id for a in agents], [a.value for a in agents],
+            prev_bids[sims], histories[sims[0]].round(t-1).clicks, reserve)
+
+    @staticmethod
+    def _balanced_bids(ids, values, bids, clicks, reserve):
+        """
+        The balanced bid for each agent j with ids[j] and values[j], given
+        row j of bids (an integer array of everyone's bids last round, by
+        id) and last round's clicks.  Uses integer arithmetic, so it
+        matches market_bid when the bids are whole cents.
+        """
+        rows = numpy.arange(len(ids))
+        ids = numpy.array(ids)
+        values = numpy.array(values)
+        clicks = numpy.array(clicks)
+        num_slots = len(clicks)
+
+        # Everyone else's valid bids, highest first, padded so there's one
+        # per slot: the bid needed to tie for each slot
+        valid = bids >= reserve
+        valid[rows, ids] = False
+        ranked = -numpy.sort(numpy.where(valid, -bids, 1), axis=1)
+        if ranked.shape[1] < num_slots:
+            pad = numpy.zeros((len(ids), num_slots - ranked.shape[1]),
+                              dtype=ranked.dtype)
+            ranked = numpy.hstack([ranked, pad])
+        num_valid = valid.sum(1)[:, None]
+        min_bids = numpy.where(numpy.arange(num_slots) < num_valid,
+                               ranked[:, :num_slots], reserve)
+
+        # Target the slot with the most utility (the first, on ties)
+        slots = numpy.argmax(clicks * (values[:, None] - min_bids), axis=1)
+        min_bid = min_bids[rows, slots]
+        above = clicks[numpy.maximum(slots - 1, 0)]
+        balanced = (above * values - clicks[slots] * (values - min_bid)) // above
+        return numpy.where((slots == 0) | (min_bid >= values),
+                           values, balanced).tolist()
+
     def __repr__(self):
         return "%s(id=%d, value=%d)" % (
             self.__class__.__name__, self.id, self.value)
@@ -2,8 +2,8 @@
 
 import sys
 from auction import iround
-import math
-from gsp import GSP
+from gsp import SlotPriceIndex
+from clickmodel import ClickModel, DEFAULT_DROPOFF
 from util import argmax_index
 
 class HHAWbudget:
@@ -15,60 +15,58 @@ class HHAWbudget:
         self.TOTAL_CLICKS = 0
         self.NUMBER_OF_PLAYERS = 0
         self.NUMBER_OF_SLOTS = 0
+        self.NUMBER_OF_ROUNDS = 0
+        self.click_model = None
+        # From observe: what we've spent, and the total clicks through
+        # each round so far
+        self.spent = 0
+        self.past_clicks = []
 
     def initialize_parameters(self, t, history):
         num_slots = len(history.round(t-1).clicks)
 
         self.NUMBER_OF_SLOTS = num_slots
 
-        total_clicks = 0
-        for time in range(48):
-            total_clicks += self.clicks_round(time)
+        # Use the simulator's click model; without one, assume the
+        # default 48-round day, with the dropoff seen in the last round.
+        self.click_model = history.click_model
+        if self.click_model is None:
+            clicks = history.round(t-1).clicks
+            dropoff = DEFAULT_DROPOFF
+            if len(clicks) > 1 and clicks[0] > 0:
+                dropoff = clicks[1] / float(clicks[0])
+            self.click_model = ClickModel.diurnal(48, num_slots, dropoff)
+        self.NUMBER_OF_ROUNDS = self.click_model.num_rounds
 
-        self.TOTAL_CLICKS = total_clicks
+        self.TOTAL_CLICKS = float(self.click_model.total_clicks())
 
         self.NUMBER_OF_PLAYERS = len(history.round(t-1).bids)
 
     def clicks_round(self, t):
-        clicks = 0.0
-        for slot in range(self.NUMBER_OF_SLOTS):
-            clicks += self.clicks_slot(t, slot)
-
-        return clicks
+        return float(self.click_model.round_clicks(t))
 
     def clicks_slot(self, t, slot):
-        return iround(iround(30*math.cos(math.pi*t/24) + 50)*(.75**slot))
+        return self.click_model.slot_clicks(t, slot)
 
     def clicks_factor(self, t):
-        return (self.clicks_round(t)/(self.TOTAL_CLICKS/48))**(.33)
+        return (self.clicks_round(t)/(self.TOTAL_CLICKS/self.NUMBER_OF_ROUNDS))**(.33)
 
     def calculate_past_clicks(self, t, history):
-        past_clicks = 0
-        for i in range(t-1):
-            past_clicks += sum(history.round(i).clicks)
-        return past_clicks
-
-    def calculate_budgets(self, t, history):
-       # sorted from lowest bid to highest
-       id_to_budget = dict()
-
-       ids = list()
-       for i in xrange(len(history.round(t-1).bids)):
-           ids.append(history.round(t-1).bids[i][0])
-
-       for idx in ids:
-           for i in xrange(t):
-               bids = sorted(history.round(i).bids, key=lambda bid: -bid[1])
-               slot_num = -1
-               for j in xrange(len(bids)-1):
-                   if bids[j][0] == idx and j < len(history.round(i).slot_payments):
-                       slot_num = j
-               if not idx in id_to_budget:
-                   id_to_budget[idx] = 0
-               if slot_num != -1:
-                   id_to_budget[idx] = id_to_budget[idx] + history.round(i).slot_payments[slot_num]
-
-       return id_to_budget
+        if len(self.past_clicks) < t:
+            # Not observing rounds: ask the history
+            return history.clicks_through(t-2)
+        return self.past_clicks[t-2] if t >= 2 else 0
+
+    def spent_through_last_round(self, t, history):
+        if len(self.past_clicks) < t:
+            return history.spent_through(self.id, t-1)
+        return self.spent
+
+    def observe(self, t, result):
+        """Keep running totals of our spending and of all clicks"""
+        self.spent += result.payment
+        previous = self.past_clicks[-1] if self.past_clicks else 0
+        self.past_clicks.append(previous + sum(result.slot_clicks))
 
     def defaults(self, t, history, reserve):
         num_zero = 0
@@ -85,7 +83,7 @@ class HHAWbudget:
         return num_zero
 
     def budget_factor(self, t, history, reserve):
-        budget = self.calculate_budgets(t, history)[self.id]
+        budget = self.spent_through_last_round(t, history)
         past_clicks = self.calculate_past_clicks(t, history)
         defaults = self.defaults(t, history, reserve)
 
@@ -95,7 +93,7 @@ class HHAWbudget:
             return 0
         elif budget_value < .8 and defaults >= 1:
             return 0
-        elif budget_value < .85 and defaults >= 1.5 and t < 47:
+        elif budget_value < .85 and defaults >= 1.5 and t < self.NUMBER_OF_ROUNDS - 1:
             return 0
 
         return budget_value
@@ -128,11 +126,13 @@ class HHAWbudget:
         else:
             avr_round = prev_round.bids
 
-        other_bids = filter(lambda (a_id, b): a_id != self.id, avr_round)
-
         clicks = prev_round.clicks
+        # Rank the predicted bids once, rather than once per slot
+        ranges = SlotPriceIndex(reserve, avr_round).bid_ranges(
+            len(clicks), exclude=self.id)
+
         def compute(s):
-            (min, max) = GSP.bid_range_for_slot(s, clicks, reserve, other_bids)
+            (min, max) = ranges[s]
             if max == None:
                 max = 2 * min
             return (s, min, max)
@@ -142,7 +142,7 @@ class HHAWbudget:
         return info
 
     
-    def expected_utils(self, t, history, reserve):
+    def expected_utils(self, t, history, reserve, info=None):
         """
         Figure out the expected utility of bidding such that we win each
         slot, assuming that everyone else keeps their bids constant from
@@ -154,7 +154,8 @@ class HHAWbudget:
         clicks = history.round(t-1).clicks
         utilities = [0.0]*(len(clicks))   # Change this
 
-        info = self.slot_info(t, history, reserve)
+        if info is None:
+            info = self.slot_info(t, history, reserve)
 
         for i in xrange(len(clicks)):
             s_k = self.clicks_slot(t, i)
@@ -170,8 +171,8 @@ class HHAWbudget:
         the other-agent bid for that slot in the last round.  If slot_id = 0,
         max_bid is min_bid * 2
         """
-        i =  argmax_index(self.expected_utils(t, history, reserve))
         info = self.slot_info(t, history, reserve)
+        i =  argmax_index(self.expected_utils(t, history, reserve, info))
         return info[i]
 
     def initial_bid(self, reserve):
@@ -1,38 +1,461 @@
 #!/usr/bin/env python
 
-import copy
+try:
+    import numpy
+except ImportError:
+    # Only needed for ColumnarHistory
+    numpy = None
+
+from gsp import SlotPriceIndex
 
 class History:
     class RoundHistory:
         """
         Allows agents to access the history of a previous round.
-        Makes copies so clients can't change history.
+        The round is frozen into tuples once, and the attributes can't be
+        reassigned, so the same object can be handed to every client
+        without copying and clients still can't change history.
         """
         def __init__(self, bids, occupants, clicks,
                      per_click_payments, slot_payments):
             """Takes the info for a _single_ round."""
-            self.bids = copy.deepcopy(bids)
-            self.occupants = copy.deepcopy(occupants)
-            self.clicks = copy.deepcopy(clicks)
-            self.per_click_payments = copy.deepcopy(per_click_payments)
-            self.slot_payments = copy.deepcopy(slot_payments)
+            d = self.__dict__
+            d['bids'] = tuple(tuple(b) for b in bids)
+            d['occupants'] = tuple(occupants)
+            d['clicks'] = tuple(clicks)
+            d['per_click_payments'] = tuple(per_click_payments)
+            d['slot_payments'] = tuple(slot_payments)
+
+        def __setattr__(self, name, value):
+            raise AttributeError("round history is read-only")
+
+        def __delattr__(self, name):
+            raise AttributeError("round history is read-only")
 
     def __init__(self, bids, occupants, clicks,
-                 per_click_payments, slot_payments, n_agents=3):
-        self.round = lambda t: History.RoundHistory(
-            bids[t], occupants[t],
-            clicks[t], per_click_payments[t],
-            slot_payments[t])
+                 per_click_payments, slot_payments, n_agents=3,
+                 click_model=None):
+        self._bids = bids
+        self._occupants = occupants
+        self._clicks = clicks
+        self._per_click_payments = per_click_payments
+        self._slot_payments = slot_payments
+        # round # -> frozen RoundHistory
+        self._rounds = {}
+        # Running totals through each round, in round order
+        self._totals = []
+        # (round #, reserve) -> SlotPriceIndex, for the latest round asked
+        self._price_indexes = {}
+
+        self.n_agents = n_agents
+        # ClickModel the simulator is using, if any
+        self.click_model = click_model
+        ## How much the agents spend.
+        self.agents_spent = [0 for i in range(n_agents)]
+
+    def record_round(self, t, bids, occupants, clicks,
+                     per_click_payments, slot_payments):
+        """
+        Store the results of round t, as computed by the simulator, and
+        freeze it.  Only what agents may see goes in: no values, and so no
+        utilities.
+        """
+        self._bids[t] = bids
+        self._occupants[t] = occupants
+        self._clicks[t] = clicks
+        self._per_click_payments[t] = per_click_payments
+        self._slot_payments[t] = slot_payments
+        self.end_round(t)
+
+    def end_round(self, t):
+        """
+        Freeze round t.  Called by the simulator once all of the round's
+        data is in; the round must not change after this.
+        """
+        r = History.RoundHistory(
+            self._bids[t], self._occupants[t],
+            self._clicks[t], self._per_click_payments[t],
+            self._slot_payments[t])
+        self._rounds[t] = r
+        if t == len(self._totals):
+            self._totals.append(self._totals_through(t-1).add(r))
+        return r
+
+    def _totals_through(self, t):
+        """RunningTotals through round t (empty if t is before round 0)."""
+        if t < 0:
+            return NO_TOTALS
+        while len(self._totals) <= t:
+            # Rounds frozen out of order (hand-built histories): catch up.
+            # end_round adds the totals for rounds it freezes in order.
+            k = len(self._totals)
+            if k in self._rounds:
+                self._totals.append(self._totals_through(k-1).add(self._rounds[k]))
+            else:
+                self.end_round(k)
+        return self._totals[t]
+
+    def spent_through(self, agent_id, t):
+        """Total agent_id spent in rounds 0 through t.  O(1)."""
+        return self._totals_through(t).spent.get(agent_id, 0)
+
+    def agent_clicks_through(self, agent_id, t):
+        """Total clicks agent_id got in rounds 0 through t.  O(1)."""
+        return self._totals_through(t).agent_clicks.get(agent_id, 0)
+
+    def clicks_through(self, t):
+        """Total clicks, over all slots, in rounds 0 through t.  O(1)."""
+        return self._totals_through(t).clicks
+
+    def revenue_through(self, t):
+        """Total payments in rounds 0 through t.  O(1)."""
+        return self._totals_through(t).revenue
+
+    def average_price_through(self, t):
+        """
+        Average price per click sold in rounds 0 through t, or 0 if no
+        clicks were sold.  O(n_agents).
+        """
+        totals = self._totals_through(t)
+        sold = sum(totals.agent_clicks.values())
+        if sold == 0:
+            return 0.0
+        return totals.revenue / float(sold)
+
+    def price_index(self, t, reserve):
+        """
+        Return a (read-only) SlotPriceIndex over round t's bids, built the
+        first time it's asked for and shared by everyone after that.
+        """
+        return _price_index(self, t, reserve)
+
+    def round(self, t):
+        """
+        Return the (read-only) RoundHistory for round t.  The same object
+        is returned on every call.
+
+        Agents should only look back SUMMARY_WINDOW rounds (t-1 and t-2):
+        with --history-store summary, older rounds raise RoundNotKept.
+        Totals over all rounds are in spent_through, clicks_through and
+        the like.
+        """
+        r = self._rounds.get(t)
+        if r is None:
+            r = self.end_round(t)
+        return r
+
+    def last_round(self):
+        return max(self._indices())
+
+    def num_rounds(self):
+        return max(self._indices()) + 1
+
+    def _indices(self):
+        # bids may be a dict (round # -> bids), or a list for
+        # hand-built histories.
+        if isinstance(self._bids, dict):
+            return self._bids.keys()
+        return range(len(self._bids))
+
+    def set_agent_spent(self, aid, spent):
+        self.agents_spent[aid] = spent
+
+
+class RunningTotals:
+    """
+    Totals over every round through some round: per-agent spend and clicks
+    (dicts id -> total), total clicks and revenue.
+    """
+    def __init__(self, spent, agent_clicks, clicks, revenue):
+        self.spent = spent
+        self.agent_clicks = agent_clicks
+        self.clicks = clicks
+        self.revenue = revenue
 
-        self.last_round = lambda : max(bids.keys())
+    def add(self, r):
+        """Return the totals through the next round, whose RoundHistory
+        is r."""
+        spent = dict(self.spent)
+        agent_clicks = dict(self.agent_clicks)
+        for (a, c, p) in zip(r.occupants, r.clicks, r.slot_payments):
+            spent[a] = spent.get(a, 0) + p
+            agent_clicks[a] = agent_clicks.get(a, 0) + c
+        return RunningTotals(spent, agent_clicks,
+                             self.clicks + sum(r.clicks),
+                             self.revenue + sum(r.slot_payments))
+
+# Totals before the first round
+NO_TOTALS = RunningTotals({}, {}, 0, 0)
+
+# How many rounds a SummaryHistory keeps by default: the agents here
+# look back at most two rounds (round t-1 and t-2)
+SUMMARY_WINDOW = 2
+
+class RoundNotKept(KeyError):
+    """Raised when asking a SummaryHistory for a round that has fallen out
+    of its window"""
+    def __init__(self, t, window):
+        KeyError.__init__(self,
+            "round %d is older than the last %d rounds this history keeps "
+            "(run with a bigger --history-window, or --history-store lists)"
+            % (t, window))
+
+
+class SummaryHistory(History):
+    """
+    History that keeps only the last `window` rounds, in a ring buffer,
+    plus running totals over every round, so memory and the cost of a
+    round don't grow with the number of rounds.  Rounds older than the
+    window, and totals through them, are gone: asking for them raises
+    RoundNotKept, a KeyError.  What's left of them is in the totals
+    through the rounds that are kept (spent_through, clicks_through, average_price_through,
+    ...).
+    """
+    def __init__(self, window, n_agents=3, click_model=None):
+        if window < 1:
+            raise ValueError("window must be at least 1 round")
+        History.__init__(self, {}, {}, {}, {}, {}, n_agents, click_model)
+        self.window = window
+        # Round t is in slot t % window, as (t, RoundHistory, RunningTotals
+        # through t), until round t + window replaces it
+        self._ring = [None] * window
+        self._last_round = -1
+
+    def record_round(self, t, bids, occupants, clicks,
+                     per_click_payments, slot_payments):
+        """Freeze round t, fold it into the totals, and store it over the
+        round that just left the window."""
+        r = History.RoundHistory(bids, occupants, clicks,
+                                 per_click_payments, slot_payments)
+        totals = self._totals_through(t-1).add(r)
+        self._ring[t % self.window] = (t, r, totals)
+        self._last_round = t
+
+    def _entry(self, t):
+        """Round t's ring entry, or None if it isn't in the window"""
+        if t < 0:
+            return None
+        entry = self._ring[t % self.window]
+        if entry is None or entry[0] != t:
+            return None
+        return entry
+
+    def _totals_through(self, t):
+        if t < 0:
+            return NO_TOTALS
+        entry = self._entry(t)
+        if entry is None:
+            raise RoundNotKept(t, self.window)
+        return entry[2]
+
+    def round(self, t):
+        entry = self._entry(t)
+        if entry is None:
+            raise RoundNotKept(t, self.window)
+        return entry[1]
+
+    def last_round(self):
+        return self._last_round
+
+    def num_rounds(self):
+        return self._last_round + 1
+
+
+class ColumnarHistory:
+    """
+    Same interface as History, but stores every round in preallocated
+    NumPy arrays (rounds x slots and rounds x agents) instead of per-round
+    lists.  Much smaller for long horizons.
+
+    Bids and payments may be ints or floats; we remember which, so agents
+    see exactly the values that were recorded, and totals of int payments
+    come back as ints, as they do from History.
+    """
+    # How many RoundHistory objects to keep around.  Agents mostly look at
+    # the last round or two; older rounds are rebuilt from the arrays.
+    CACHED_ROUNDS = 4
+
+    def __init__(self, max_rounds, num_slots, agent_ids, click_model=None):
+        if numpy is None:
+            raise ImportError("ColumnarHistory requires numpy")
+        n_agents = len(agent_ids)
+        self.max_rounds = max_rounds
+        self.num_slots = num_slots
+        self.agent_ids = list(agent_ids)
         self.n_agents = n_agents
-        self.num_rounds = lambda : max(bids.keys()) + 1
+        # ClickModel the simulator is using, if any
+        self.click_model = click_model
         ## How much the agents spend.
         self.agents_spent = [0 for i in range(n_agents)]
 
+        R, S, N = max_rounds, num_slots, n_agents
+        # rounds x agents
+        self.bid_ids = numpy.zeros((R, N), dtype=numpy.int32)
+        self.bids = numpy.zeros((R, N))
+        self.bids_int = numpy.zeros((R, N), dtype=bool)
+        # rounds x slots.  Unfilled slots have occupant -1 and payment 0.
+        self.occupants = numpy.empty((R, S), dtype=numpy.int32)
+        self.occupants.fill(-1)
+        self.clicks = numpy.zeros((R, S), dtype=numpy.int64)
+        self.per_click_payments = numpy.zeros((R, S))
+        self.per_click_int = numpy.zeros((R, S), dtype=bool)
+        self.slot_payments = numpy.zeros((R, S))
+        self.slot_payments_int = numpy.zeros((R, S), dtype=bool)
+        # rounds
+        self.num_bids = numpy.zeros(R, dtype=numpy.int32)
+        self.num_allocated = numpy.zeros(R, dtype=numpy.int32)
+        self.num_clicks = numpy.zeros(R, dtype=numpy.int32)
+        # Running totals through each round.  A spend or revenue total is
+        # an int as long as every payment in it was.
+        self.cum_spent = numpy.zeros((R, N))
+        self.cum_spent_int = numpy.ones((R, N), dtype=bool)
+        self.cum_agent_clicks = numpy.zeros((R, N), dtype=numpy.int64)
+        self.cum_clicks = numpy.zeros(R, dtype=numpy.int64)
+        self.cum_revenue = numpy.zeros(R)
+        self.cum_revenue_int = numpy.ones(R, dtype=bool)
+        # agent id -> column in the rounds x agents arrays
+        self._column = dict((a, i) for (i, a) in enumerate(self.agent_ids))
+
+        self._num_rounds = 0
+        self._rounds = {}
+        # (round #, reserve) -> SlotPriceIndex, for the latest round asked
+        self._price_indexes = {}
+
+    def record_round(self, t, bids, occupants, clicks,
+                     per_click_payments, slot_payments):
+        """Store the results of round t.  See History.record_round."""
+        k = len(bids)
+        self.num_bids[t] = k
+        if k > 0:
+            (ids, amounts) = zip(*bids)
+            self.bid_ids[t, :k] = ids
+            _put(self.bids, self.bids_int, t, amounts)
+
+        k = len(occupants)
+        self.num_allocated[t] = k
+        self.occupants[t, :k] = occupants
+        _put(self.per_click_payments, self.per_click_int, t, per_click_payments)
+        _put(self.slot_payments, self.slot_payments_int, t, slot_payments)
+
+        self.num_clicks[t] = len(clicks)
+        self.clicks[t, :len(clicks)] = clicks
+
+        # Rounds are recorded in order, so extend the running totals
+        if t > 0:
+            self.cum_spent[t] = self.cum_spent[t-1]
+            self.cum_spent_int[t] = self.cum_spent_int[t-1]
+            self.cum_agent_clicks[t] = self.cum_agent_clicks[t-1]
+            self.cum_clicks[t] = self.cum_clicks[t-1]
+            self.cum_revenue[t] = self.cum_revenue[t-1]
+            self.cum_revenue_int[t] = self.cum_revenue_int[t-1]
+        for (a, c, p) in zip(occupants, clicks, slot_payments):
+            self.cum_spent[t, self._column[a]] += p
+            self.cum_agent_clicks[t, self._column[a]] += c
+            if not isinstance(p, (int, long)):
+                self.cum_spent_int[t, self._column[a]] = False
+                self.cum_revenue_int[t] = False
+        self.cum_clicks[t] += sum(clicks)
+        self.cum_revenue[t] += sum(slot_payments)
+        self._num_rounds = max(self._num_rounds, t + 1)
+
+    def spent_through(self, agent_id, t):
+        """Total agent_id spent in rounds 0 through t.  O(1)."""
+        if t < 0:
+            return 0
+        column = self._column[agent_id]
+        return _total(self.cum_spent[t, column], self.cum_spent_int[t, column])
+
+    def agent_clicks_through(self, agent_id, t):
+        """Total clicks agent_id got in rounds 0 through t.  O(1)."""
+        if t < 0:
+            return 0
+        return self.cum_agent_clicks[t, self._column[agent_id]].item()
+
+    def average_price_through(self, t):
+        """
+        Average price per click sold in rounds 0 through t, or 0 if no
+        clicks were sold.  O(n_agents).
+        """
+        if t < 0:
+            return 0.0
+        sold = self.cum_agent_clicks[t].sum().item()
+        if sold == 0:
+            return 0.0
+        return self.cum_revenue[t].item() / float(sold)
+
+    def clicks_through(self, t):
+        """Total clicks, over all slots, in rounds 0 through t.  O(1)."""
+        if t < 0:
+            return 0
+        return self.cum_clicks[t].item()
+
+    def revenue_through(self, t):
+        """Total payments in rounds 0 through t.  O(1)."""
+        if t < 0:
+            return 0
+        return _total(self.cum_revenue[t], self.cum_revenue_int[t])
+
+    def round(self, t):
+        """Return the (read-only) RoundHistory for round t."""
+        r = self._rounds.get(t)
+        if r is not None:
+            return r
+        if t < 0 or t >= self._num_rounds:
+            raise KeyError(t)
+
+        k = self.num_bids[t]
+        bids = zip(self.bid_ids[t, :k].tolist(),
+                   _get(self.bids, self.bids_int, t, k))
+        k = self.num_allocated[t]
+        r = History.RoundHistory(
+            bids,
+            self.occupants[t, :k].tolist(),
+            self.clicks[t, :self.num_clicks[t]].tolist(),
+            _get(self.per_click_payments, self.per_click_int, t, k),
+            _get(self.slot_payments, self.slot_payments_int, t, k))
+
+        if len(self._rounds) >= self.CACHED_ROUNDS:
+            del self._rounds[min(self._rounds)]
+        self._rounds[t] = r
+        return r
+
+    def price_index(self, t, reserve):
+        """See History.price_index."""
+        return _price_index(self, t, reserve)
+
+    def last_round(self):
+        return self._num_rounds - 1
+
+    def num_rounds(self):
+        return self._num_rounds
+
     def set_agent_spent(self, aid, spent):
         self.agents_spent[aid] = spent
 
 
+def _price_index(history, t, reserve):
+    """history's SlotPriceIndex for round t and reserve.  Agents only ask
+    about the last round, so the indexes for older rounds are dropped."""
+    key = (t, reserve)
+    index = history._price_indexes.get(key)
+    if index is None:
+        if any(k != t for (k, _) in history._price_indexes):
+            history._price_indexes = {}
+        index = SlotPriceIndex(reserve, history.round(t).bids)
+        history._price_indexes[key] = index
+    return index
+
+def _put(data, is_int, t, vals):
+    """Store vals in row t of data, remembering which ones were ints."""
+    k = len(vals)
+    data[t, :k] = vals
+    is_int[t, :k] = [isinstance(v, (int, long)) for v in vals]
 
+def _total(total, is_int):
+    """A running total read back as an int, if it's a sum of ints."""
+    return int(total) if is_int else total.item()
 
+def _get(data, is_int, t, k):
+    """Read back the first k values of row t, as they were stored."""
+    return [int(v) if i else v
+            for (v, i) in zip(data[t, :k].tolist(), is_int[t, :k].tolist())]
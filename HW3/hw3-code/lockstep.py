@@ -0,0 +1,258 @@
+#!/usr/bin/env python
+
+# Runs many simulations of the same auction at once, for --lockstep: each
+# round, all their auctions are cleared in one vectorized call.
+
+import copy
+import random
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from vcg import VCG
+from market import MarketSnapshot
+from clickmodel import ClickModel
+from stats import Stats
+from auction import (init_agents, start_mechanism, make_history,
+                     notify_observers)
+
+def add_spending(total_spent, rows, ids, payments):
+    """
+    Add payments to a (simulations x agents) array of totals spent, at the
+    given rows and agent ids.  Returns the array, which is copied to floats
+    the first time a payment is a fraction of a cent.
+    """
+    payments = numpy.asarray(payments)
+    if len(payments) == 0:
+        return total_spent
+    if payments.dtype.kind == 'f' and total_spent.dtype.kind != 'f':
+        total_spent = total_spent.astype(float)
+    numpy.add.at(total_spent, (numpy.asarray(rows, dtype=int),
+                               numpy.asarray(ids, dtype=int)), payments)
+    return total_spent
+
+class RowRandom:
+    """
+    Stands in for a numpy RandomState in compute_batch, drawing each row
+    of a sample from the RandomState of the simulation that row belongs
+    to, so what one simulation draws doesn't depend on the others.
+    """
+    def __init__(self, rngs):
+        self.rngs = rngs
+
+    def random_sample(self, shape):
+        return numpy.array([rng.random_sample(shape[1:])
+                            for rng in self.rngs])
+
+def sim_lockstep(configs, seeds):
+    """
+    Run one simulation per config, all advancing together a round at a
+    time.  The configs must differ only in agent_values: the agent classes,
+    mechanism, reserve, budget and clicks are shared.  Returns the list of
+    histories.
+
+    Each round, the bids from all K simulations go into one K x n array,
+    cleared by a single mechanism.compute_batch call.  Simulation k breaks
+    ties with its own random streams, seeded with seeds[k], so its result
+    doesn't depend on which other simulations it runs with.  (The streams
+    aren't the ones sim draws from, so ties may go differently than in sim
+    with the same seed.)  Agent classes with a
+    bid_many(agents, rows, t, histories, reserve, prev_bids) static method
+    are asked for the bids of all their agents in all simulations at once:
+    agents[j] is in simulation rows[j], and prev_bids is the K x n array of
+    the bids recorded for the last round.  It returns one bid per agent.
+    Other agents bid one at a time, and observers hear about every round,
+    as in sim.
+    """
+    if numpy is None:
+        raise ImportError("sim_lockstep requires numpy")
+    config = configs[0]
+    num_sims = len(configs)
+    sims = [init_agents(c) for c in configs]
+    n = len(sims[0])
+    agent_ids = range(n)
+    mechanism = start_mechanism(config)
+    reserve = config.reserve
+    num_slots = max(1, n-1)
+    click_model = ClickModel.for_config(config, num_slots)
+    histories = [make_history(config, num_slots, agent_ids, click_model)
+                 for k in range(num_sims)]
+
+    # Agents by class: a class with bid_many gets all its agents in every
+    # simulation at once, in (simulation, id) order
+    batched = {}
+    single = []
+    for (k, agents) in enumerate(sims):
+        for a in agents:
+            if hasattr(a.__class__, 'bid_many'):
+                batched.setdefault(a.__class__, ([], []))
+                batched[a.__class__][0].append(a)
+                batched[a.__class__][1].append(k)
+            else:
+                single.append((k, a))
+
+    # Tie-breaking streams: numpy for batches, Python's for the
+    # simulations mechanism.compute clears on their own
+    rngs = [numpy.random.RandomState(seed % (2 ** 32)) for seed in seeds]
+    py_states = [random.Random(seed).getstate() for seed in seeds]
+    observers = [[a for a in agents if hasattr(a, 'observe')]
+                 for agents in sims]
+    total_spent = numpy.zeros((num_sims, n), dtype=int)
+    prev_bids = None
+
+    for t in range(0, config.num_rounds):
+        if t == config.num_rounds / 2 and config.mechanism == 'switch':
+            mechanism = VCG
+
+        ## 1. Bids, kept as Python numbers for the histories
+        raw_bids = [[0] * n for k in range(num_sims)]
+        if t == 0:
+            for (k, agents) in enumerate(sims):
+                for a in agents:
+                    raw_bids[k][a.id] = a.initial_bid(reserve)
+        else:
+            for (cls, (agents, agent_sims)) in batched.items():
+                bids = cls.bid_many(agents, agent_sims, t, histories, reserve,
+                                    prev_bids)
+                for (a, k, b) in zip(agents, agent_sims, bids):
+                    raw_bids[k][a.id] = b
+            markets = {}
+            for (k, a) in single:
+                if hasattr(a, 'market_bid'):
+                    if k not in markets:
+                        markets[k] = MarketSnapshot(
+                            t, histories[k], reserve,
+                            zip(agent_ids, total_spent[k].tolist()))
+                    b = a.market_bid(t, histories[k], reserve, markets[k])
+                else:
+                    b = a.bid(t, histories[k], reserve)
+                raw_bids[k][a.id] = b
+            # Bids from agents with no money get reduced to zero
+            broke = (total_spent >= config.budget).tolist()
+            for k in range(num_sims):
+                for id in agent_ids:
+                    if broke[k][id]:
+                        raw_bids[k][id] = 0
+        slot_clicks = list(click_model.clicks(t))
+
+        ## 2. Clear all the auctions at once.  Payments keep the types of
+        ## the bids they come from (and VCG only floors per-click prices
+        ## made of whole cents), so a simulation with fractional bids is
+        ## cleared on its own, exactly as sim would.
+        single_rows = [k for k in range(num_sims)
+                       if any(isinstance(b, float) for b in raw_bids[k])]
+        # k -> (occupants, per-click payments, slot payments)
+        outcomes = [None] * num_sims
+        batch_rows = sorted(set(range(num_sims)) - set(single_rows))
+        if batch_rows:
+            rows = numpy.array(batch_rows)[:, None]
+            (allocation, per_click) = mechanism.compute_batch(
+                slot_clicks, reserve,
+                numpy.array([raw_bids[k] for k in batch_rows]),
+                RowRandom([rngs[k] for k in batch_rows]))
+
+            ## 3. Payments
+            filled = allocation >= 0
+            clicks = numpy.array(slot_clicks)
+            payments = numpy.where(filled, per_click * clicks, 0)
+            occupants = numpy.where(filled, allocation, 0)
+            payer_rows = numpy.broadcast_to(rows, occupants.shape)[filled]
+            total_spent = add_spending(total_spent, payer_rows,
+                                       occupants[filled], payments[filled])
+
+            # Filled slots are always at the top
+            num_filled = filled.sum(1).tolist()
+            (allocation, per_click, payments) = (
+                allocation.tolist(), per_click.tolist(), payments.tolist())
+            for (j, k) in enumerate(batch_rows):
+                m = num_filled[j]
+                outcomes[k] = (allocation[j][:m], per_click[j][:m],
+                               payments[j][:m])
+        for k in single_rows:
+            caller_state = random.getstate()
+            random.setstate(py_states[k])
+            (occupants, per_click) = mechanism.compute(
+                slot_clicks, reserve, zip(agent_ids, raw_bids[k]))
+            py_states[k] = random.getstate()
+            random.setstate(caller_state)
+            payments = [c * p for (c, p) in zip(slot_clicks, per_click)]
+            total_spent = add_spending(total_spent, [k] * len(occupants),
+                                       occupants, payments)
+            outcomes[k] = (occupants, per_click, payments)
+
+        ## 4. Record the rounds, and tell the agents that want to know
+        for k in range(num_sims):
+            (occupants, per_click, payments) = outcomes[k]
+            bids = zip(agent_ids, raw_bids[k])
+            histories[k].record_round(t, bids, occupants, slot_clicks,
+                                      per_click, payments)
+            if observers[k]:
+                notify_observers(observers[k], t, bids, occupants,
+                                 slot_clicks, payments)
+        prev_bids = numpy.array(raw_bids)
+
+    spent = total_spent.tolist()
+    for k in range(num_sims):
+        for id in agent_ids:
+            histories[k].set_agent_spent(id, spent[k][id])
+    return histories
+
+def run_lockstep(tasks):
+    """
+    Run_task for a list of tasks that share a config, as one sim_lockstep
+    run, each simulation breaking ties with its own task's seed.  Returns
+    the list of run_task results.
+    """
+    configs = []
+    for (config, vals, seed) in tasks:
+        config = copy.copy(config)
+        config.agent_values = vals
+        configs.append(config)
+    # Third-party agents may still use the global random stream
+    caller_state = random.getstate()
+    random.seed(tasks[0][2])
+    histories = sim_lockstep(configs, [seed for (_, _, seed) in tasks])
+    random.setstate(caller_state)
+
+    results = []
+    for ((config, vals, seed), history) in zip(tasks, histories):
+        n = len(vals)
+        summary = Stats(history, dict(zip(range(n), vals))).summarize()
+        utils = [summary['utility'][id] for id in range(n)]
+        results.append((utils, list(history.agents_spent), summary['revenue'], {}))
+    return results
+
+def lockstep_map(run_all, k):
+    """
+    Wrap a map-like run_all(run_task, tasks) to run the tasks k at a time
+    in lockstep instead.  Tasks with the same config go in one group, even
+    when tasks for other configs (e.g. other mechanisms) come between them.
+    Results come back in the order of tasks.
+    """
+    def run(func, tasks):
+        # func is run_task: each group goes to run_lockstep instead
+        # id(config) -> indices into tasks, in order
+        by_config = {}
+        order = []
+        for (i, task) in enumerate(tasks):
+            key = id(task[0])
+            if key not in by_config:
+                by_config[key] = []
+                order.append(key)
+            by_config[key].append(i)
+        index_groups = []
+        for key in order:
+            indices = by_config[key]
+            for start in range(0, len(indices), k):
+                index_groups.append(indices[start:start + k])
+
+        groups = [[tasks[i] for i in indices] for indices in index_groups]
+        results = [None] * len(tasks)
+        for (indices, group_results) in zip(index_groups,
+                                            run_all(run_lockstep, groups)):
+            for (i, r) in zip(indices, group_results):
+                results[i] = r
+        return results
+    return run
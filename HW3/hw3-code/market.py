@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+from util import FrozenDict
+
+class MarketSnapshot:
+    """
+    What the agents bidding in round t know about the market, computed once
+    per round by the simulator and handed to every agent that has a
+    market_bid(t, history, reserve, market) method.
+
+      t: the round being bid on
+      reserve: the reserve price
+      prev_round: history.round(t-1)
+      clicks: clicks per slot in the previous round
+      index: SlotPriceIndex over the previous round's bids (the sorted bid
+          ladder)
+      thresholds: per slot, the bid needed to tie for it last round
+      spent: read-only dict agent id -> total spent through round t-1, or
+          None if the snapshot wasn't built by the simulator
+
+    The same snapshot goes to every agent, so it is read-only.
+    """
+    def __init__(self, t, history, reserve, spent=None):
+        d = self.__dict__
+        d['t'] = t
+        d['reserve'] = reserve
+        d['prev_round'] = history.round(t-1)
+        d['clicks'] = self.prev_round.clicks
+        d['index'] = history.price_index(t-1, reserve)
+        d['thresholds'] = tuple(min_bid for (min_bid, _) in
+                                self.index.bid_ranges(len(self.clicks)))
+        if spent is not None:
+            spent = FrozenDict(spent)
+        d['spent'] = spent
+
+    def __setattr__(self, name, value):
+        raise AttributeError("MarketSnapshot is read-only")
+
+    def __delattr__(self, name):
+        raise AttributeError("MarketSnapshot is read-only")
+
+    def bid_ranges(self, agent_id):
+        """
+        (min_bid, max_bid) for each slot given everyone else's bids from
+        the previous round.  See GSP.bid_range_for_slot.
+        """
+        return self.index.bid_ranges(len(self.clicks), exclude=agent_id)
+
+    def __repr__(self):
+        return "MarketSnapshot(t=%d, thresholds=%s)" % (
+            self.t, self.thresholds)
+
+class RoundResult:
+    """
+    What one agent learns when round t clears, handed to its
+    observe(t, result) method (if it has one) right after the round is
+    recorded, so it can keep running state instead of rereading the
+    history every round.
+
+      slot: the slot it got, or None
+      clicks: the clicks it got (0 without a slot)
+      payment: what it paid for the round, in total
+      bids: everyone's bids as (id, bid) pairs, as recorded (bids from
+          agents out of money are 0)
+      slot_clicks: the clicks in every slot
+    """
+    def __init__(self, slot, clicks, payment, bids, slot_clicks):
+        self.slot = slot
+        self.clicks = clicks
+        self.payment = payment
+        self.bids = bids
+        self.slot_clicks = slot_clicks
+
+    def __repr__(self):
+        return "RoundResult(slot=%s, clicks=%s, payment=%s)" % (
+            self.slot, self.clicks, self.payment)
@@ -0,0 +1,67 @@
+#!/usr/bin/env python
+
+import timeit
+
+# Best wall clock timer for the platform
+clock = timeit.default_timer
+
+class SimProfile:
+    """
+    Where one simulation spent its time.  times maps a phase name to total
+    seconds spent in it, and counts maps a phase (or any counted event) to
+    how many times it happened.
+
+    sim only makes one of these with --profile.  Otherwise it skips all the
+    timing, so profiling costs nothing when it's off.
+    """
+    def __init__(self):
+        self.times = {}
+        self.counts = {}
+
+    def add_time(self, phase, seconds):
+        self.times[phase] = self.times.get(phase, 0.0) + seconds
+        self.counts[phase] = self.counts.get(phase, 0) + 1
+
+    def count(self, name, k=1):
+        self.counts[name] = self.counts.get(name, 0) + k
+
+    def counting(self, name, func):
+        """func, but counting its calls under name"""
+        def counted(*args, **kwargs):
+            self.counts[name] = self.counts.get(name, 0) + 1
+            return func(*args, **kwargs)
+        return counted
+
+    def report(self):
+        """A plain dict {'times': ..., 'counts': ...} (picklable and JSON
+        friendly)"""
+        return {'times': dict(self.times), 'counts': dict(self.counts)}
+
+def merge_reports(reports):
+    """Add up a list of SimProfile reports"""
+    total = SimProfile()
+    for report in reports:
+        for (phase, seconds) in report['times'].items():
+            total.times[phase] = total.times.get(phase, 0.0) + seconds
+        for (name, k) in report['counts'].items():
+            total.count(name, k)
+    return total.report()
+
+def format_report(report, num_runs):
+    """Lines of a table of the phases, slowest first, then the counts"""
+    times = report['times']
+    counts = report['counts']
+    total = sum(times.values())
+    lines = ["%-28s %10s %6s %10s %12s" % (
+        "phase", "seconds", "%", "calls", "usec/call")]
+    for phase in sorted(times, key=lambda p: -times[p]):
+        calls = counts.get(phase, 0)
+        lines.append("%-28s %10.4f %6.1f %10d %12.2f" % (
+            phase, times[phase], 100.0 * times[phase] / total if total else 0,
+            calls, 1e6 * times[phase] / calls if calls else 0))
+    for name in sorted(counts):
+        if name not in times:
+            lines.append("%-28s %10s %6s %10d %12s" % (
+                name, "", "", counts[name], ""))
+    lines.append("(totals over %d simulations)" % num_runs)
+    return lines
@@ -2,7 +2,7 @@
 
 import sys,math
 
-from gsp import GSP
+from market import MarketSnapshot
 from util import argmax_index
 
 class Sctwbudget:
@@ -14,12 +14,14 @@ class Sctwbudget:
         self.total_spent = 0
         self.remaining = budget
         self.num_rounds = 48
+        # Whether the simulator tells us how each round went
+        self.observing = False
 
     def initial_bid(self, reserve):
         return self.value / 2
 
 
-    def slot_info(self, t, history, reserve):
+    def slot_info(self, t, history, reserve, market=None):
         """Compute the following for each slot, assuming that everyone else
         keeps their bids constant from the previous rounds.
 
@@ -28,13 +30,16 @@ class Sctwbudget:
         in the last round.  If slot_id = 0, max_bid is 2* min_bid.
         Otherwise, it's the next highest min_bid (so bidding between min_bid
         and max_bid would result in ending up in that slot)
+
+        market is the round's MarketSnapshot, if the simulator gave us one.
         """
-        prev_round = history.round(t-1)
-        other_bids = filter(lambda (a_id, b): a_id != self.id, prev_round.bids)
+        if market is None:
+            market = MarketSnapshot(t, history, reserve)
+        clicks = market.clicks
+        ranges = market.bid_ranges(self.id)
 
-        clicks = prev_round.clicks
         def compute(s):
-            (min, max) = GSP.bid_range_for_slot(s, clicks, reserve, other_bids)
+            (min, max) = ranges[s]
             if max == None:
                 max = 2 * min
             return (s, min, max)
@@ -44,18 +49,21 @@ class Sctwbudget:
         return info
 
 
-    def expected_utils(self, t, history, reserve):
+    def expected_utils(self, t, history, reserve, info=None):
         """
         Figure out the expected utility of bidding such that we win each
         slot, assuming that everyone else keeps their bids constant from
         the previous round.
 
+        info is the result of slot_info, if it's already been computed.
+
         returns a list of utilities per slot.
         """
 
         prev_round = history.round(t-1)
         clicks = prev_round.clicks
-        info = self.slot_info(t, history, reserve)
+        if info is None:
+            info = self.slot_info(t, history, reserve)
 
         utilities = [None]*len(clicks)
         for i in range(0,len(clicks)):
@@ -63,7 +71,7 @@ class Sctwbudget:
 
         return utilities
 
-    def target_slot(self, t, history, reserve):
+    def target_slot(self, t, history, reserve, market=None):
         """Figure out the best slot to target, assuming that everyone else
         keeps their bids constant from the previous rounds.
 
@@ -71,11 +79,15 @@ class Sctwbudget:
         the other-agent bid for that slot in the last round.  If slot_id = 0,
         max_bid is min_bid * 2
         """
-        i =  argmax_index(self.expected_utils(t, history, reserve))
-        info = self.slot_info(t, history, reserve)
+        info = self.slot_info(t, history, reserve, market)
+        i =  argmax_index(self.expected_utils(t, history, reserve, info))
         return info[i]
 
     def bid(self, t, history, reserve):
+        return self.market_bid(t, history, reserve,
+                               MarketSnapshot(t, history, reserve))
+
+    def market_bid(self, t, history, reserve, market):
         # The Balanced bidding strategy (BB) is the strategy for a player j that, given
         # bids b_{-j},
         # - targets the slot s*_j which maximizes his utility, that is,
@@ -88,19 +100,21 @@ class Sctwbudget:
         #        b' = (v_j + p_0(j)) / 2. We can 
         # thus deal with all slots uniformly by defining clicks_{-1} = 2 clicks_0.
         #
-        prev_round = history.round(t-1)
+        prev_round = market.prev_round
         clicks = prev_round.clicks
 
-        try:
-            slot = prev_round.occupants.index(self.id)
-        except ValueError:
-            slot = -1
-        if slot != -1:
-            prev_spend = prev_round.slot_payments[slot]
-            self.total_spent += prev_spend
-            self.remaining -= prev_spend
+        if not self.observing:
+            # Find what we paid last round ourselves
+            try:
+                slot = prev_round.occupants.index(self.id)
+            except ValueError:
+                slot = -1
+            if slot != -1:
+                prev_spend = prev_round.slot_payments[slot]
+                self.total_spent += prev_spend
+                self.remaining -= prev_spend
 
-        (slot, min_bid, max_bid) = self.target_slot(t, history, reserve)
+        (slot, min_bid, max_bid) = self.target_slot(t, history, reserve, market)
 
         # During low click, instead of max utility, try to save money
         if t > 22 and t < 26:
@@ -122,6 +136,12 @@ class Sctwbudget:
         
         return bid
 
+    def observe(self, t, result):
+        """Keep track of what we've spent as each round clears"""
+        self.observing = True
+        self.total_spent += result.payment
+        self.remaining -= result.payment
+
     def __repr__(self):
         return "%s(id=%d, value=%d)" % (
             self.__class__.__name__, self.id, self.value)
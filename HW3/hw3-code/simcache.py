@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+import cPickle as pickle
+import hashlib
+import os
+
+def source_hash(path):
+    """sha1 of a source file's contents.  Given a .pyc, hashes the .py."""
+    if path.endswith('.pyc') or path.endswith('.pyo'):
+        path = path[:-1]
+    f = open(path, 'rb')
+    try:
+        return hashlib.sha1(f.read()).hexdigest()
+    finally:
+        f.close()
+
+class SimCache:
+    """
+    Simulation results on disk, one pickle per key in directory.  Keys are
+    hex digests of everything that went into a simulation, so an entry
+    never has to be invalidated, only evicted.
+
+    Once the files take up more than max_bytes, the least recently used
+    ones are deleted.  A file's mtime is when it was last used.
+    """
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        # key -> file size
+        self._sizes = {}
+        for name in os.listdir(directory):
+            if name.endswith('.pickle'):
+                self._sizes[name[:-len('.pickle')]] = os.path.getsize(
+                    os.path.join(directory, name))
+        self._total = sum(self._sizes.values())
+
+    @staticmethod
+    def key(parts):
+        """Digest of a tuple of strings, numbers, and tuples of those"""
+        return hashlib.sha1(repr(parts)).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.pickle')
+
+    def get(self, key):
+        """The cached value, or None"""
+        if key not in self._sizes:
+            self.misses += 1
+            return None
+        path = self._path(key)
+        try:
+            f = open(path, 'rb')
+            try:
+                value = pickle.load(f)
+            finally:
+                f.close()
+            os.utime(path, None)
+        except (IOError, OSError, EOFError, pickle.UnpicklingError):
+            # Evicted by another process, or half written: recompute
+            self._forget(key)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        path = self._path(key)
+        # Write to a temp file and rename, so readers never see part of it
+        tmp = "%s.%d.tmp" % (path, os.getpid())
+        f = open(tmp, 'wb')
+        try:
+            pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+        finally:
+            f.close()
+        os.rename(tmp, path)
+        self._forget(key)
+        self._sizes[key] = os.path.getsize(path)
+        self._total += self._sizes[key]
+        if self._total > self.max_bytes:
+            self._evict()
+
+    def _forget(self, key):
+        self._total -= self._sizes.pop(key, 0)
+
+    def _evict(self):
+        """Delete least recently used entries until we're under max_bytes"""
+        def last_used(key):
+            try:
+                return os.path.getmtime(self._path(key))
+            except OSError:
+                return 0
+        for key in sorted(self._sizes, key=last_used):
+            if self._total <= self.max_bytes:
+                break
+            try:
+                os.remove(self._path(key))
+            except OSError:
+                pass
+            self._forget(key)
+
+    def cached_map(self, run_all, key_func):
+        """
+        Wrap a map-like run_all(func, tasks) so that only tasks whose
+        key_func(task) isn't cached get run, and their results are cached.
+        """
+        def run(func, tasks):
+            keys = [key_func(task) for task in tasks]
+            results = [self.get(key) for key in keys]
+            missing = [k for (k, r) in enumerate(results) if r is None]
+            fresh = run_all(func, [tasks[k] for k in missing])
+            for (k, r) in zip(missing, fresh):
+                results[k] = r
+                self.put(keys[k], r)
+            return results
+        return run
+
+    def __repr__(self):
+        return "SimCache(%s, %d entries, %d bytes)" % (
+            self.directory, len(self._sizes), self._total)
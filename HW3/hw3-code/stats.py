@@ -9,32 +9,52 @@ class Stats:
         self.values = values  # dict id->value
 
     def total_utility(self, id, verbose=False):
-        def util(t):
-            round = self.history.round(t)
-            if id not in round.occupants:
-                # Didn't get a slot in this round
-                return 0
-            slot = round.occupants.index(id)
-            return round.clicks[slot] * (
-                self.values[id] - round.per_click_payments[slot])
-
-        rounds = self.history.num_rounds()
+        """
+        Value of the clicks id got, less what it paid for them, over every
+        round.  Comes from the history's running totals, so it's O(1), and
+        works for histories that no longer keep every round.
+        """
+        last = self.history.num_rounds() - 1
         if(verbose):
-            logging.info("%d: utils: %s\n" % (id, str(list(util(t) for t in range(rounds)))))
+            def util(t):
+                round = self.history.round(t)
+                if id not in round.occupants:
+                    # Didn't get a slot in this round
+                    return 0
+                slot = round.occupants.index(id)
+                return round.clicks[slot] * (
+                    self.values[id] - round.per_click_payments[slot])
+
+            logging.info("%d: utils: %s\n" % (id, str(list(util(t) for t in range(last + 1)))))
             logging.info("%d: value = %s" % (id, self.values[id]))
-        
-        return sum(util(t) for t in range(rounds))
+
+        return (self.values[id] * self.history.agent_clicks_through(id, last) -
+                self.history.spent_through(id, last))
 
     def total_revenue(self):
-        rev = 0
-        def slot_payments(slot_clicks, per_click_payments):
-            return map(lambda (x,y): x*y,
-                       zip(slot_clicks, per_click_payments))
-
-        for i in range(self.history.num_rounds()):
-            r = self.history.round(i)
-            rev += sum(r.slot_payments)
-        return rev
+        return self.history.revenue_through(self.history.num_rounds() - 1)
+
+    def summarize(self):
+        """
+        Totals for every agent in self.values, from the history's running
+        totals.  Returns a dict with
+          'utility', 'clicks', 'spent': dicts id -> total for the agent
+          'revenue': total revenue
+        Utility is value * clicks - spent: histories don't keep utilities,
+        since agents could work out each other's values from them.
+        """
+        h = self.history
+        ids = self.values.keys()
+        last = h.num_rounds() - 1
+        summary = {
+            'clicks': dict((id, h.agent_clicks_through(id, last)) for id in ids),
+            'spent': dict((id, h.spent_through(id, last)) for id in ids),
+            'revenue': h.revenue_through(last),
+            }
+        summary['utility'] = dict(
+            (id, self.values[id] * summary['clicks'][id] - summary['spent'][id])
+            for id in ids)
+        return summary
 
     def __repr__(self):
         return "Stats(history with %d rounds, vals %s)" % (
@@ -0,0 +1,145 @@
+#!/usr/bin/env python
+
+# http://pytest.org/
+# run py.test to run the tests (it magically finds things
+# called test_blah and runs them)
+
+import copy
+
+import pytest
+
+from auction import parse_reserves
+
+def test_parse_reserves():
+    assert parse_reserves("0,10,25") == [0, 10, 25]
+    assert parse_reserves("0:20:5") == [0, 5, 10, 15, 20]
+
+def test_sim_lockstep_matches_sim(monkeypatch):
+    numpy = pytest.importorskip("numpy")
+    import heapq
+    import random
+    from optparse import Values
+    from gsp import GSP
+    from auction import sim, load_modules
+    from lockstep import sim_lockstep
+
+    # Break ties by id in both engines, so they must agree exactly
+    def top_bids(k, reserve, bids):
+        keyed = [(-b, a, b) for (a, b) in bids if b >= reserve]
+        return [(a, b) for (_, a, b) in heapq.nsmallest(k, keyed)]
+    monkeypatch.setattr(GSP, '_top_bids', staticmethod(top_bids))
+    class ById:
+        def __init__(self, seed):
+            pass
+        def random_sample(self, shape):
+            return numpy.arange(shape[0]) * 1.0
+    monkeypatch.setattr(numpy.random, 'RandomState', ById)
+
+    names = ['Truthful', 'HHAWbb', 'Truthful', 'HHAWbb']
+    for mech in ['gsp', 'vcg']:
+        base = Values(dict(
+            mechanism=mech, num_rounds=48, budget=20000, reserve=30,
+            click_period=48, click_file=None, dropoff=0.75,
+            history_store='lists', agent_class_names=names,
+            agent_classes=load_modules(names)))
+        configs = []
+        for seed in range(5):
+            random.seed(seed)
+            config = copy.copy(base)
+            config.agent_values = [random.randint(25, 175) for a in names]
+            configs.append(config)
+        for (config, h) in zip(configs, sim_lockstep(configs, range(5))):
+            expected = sim(config)
+            for t in range(48):
+                for field in ['bids', 'occupants', 'per_click_payments',
+                              'slot_payments']:
+                    assert (getattr(h.round(t), field) ==
+                            getattr(expected.round(t), field))
+            assert h.agents_spent == expected.agents_spent
+
+def test_lockstep_seeds_each_simulation():
+    pytest.importorskip("numpy")
+    from optparse import Values
+    from auction import load_modules
+    from lockstep import run_lockstep
+
+    ## Lots of ties, so tie-breaking matters
+    names = ['Truthful', 'Truthful', 'Truthful', 'HHAWbb']
+    config = Values(dict(
+        mechanism='gsp', num_rounds=48, budget=20000, reserve=30,
+        click_period=48, click_file=None, dropoff=0.75,
+        history_store='lists', agent_class_names=names,
+        agent_classes=load_modules(names)))
+    tasks = [(config, [60, 60, 60, 90], seed) for seed in range(4)]
+    together = run_lockstep(tasks)
+    for (task, result) in zip(tasks, together):
+        assert run_lockstep([task]) == [result]
+    assert run_lockstep(tasks[::-1]) == together[::-1]
+
+def test_lockstep_map_groups_by_config():
+    from auction import run_task
+    from lockstep import lockstep_map
+    (gsp, vcg) = (object(), object())
+    # Interleaved by mechanism, the way main builds paired tasks
+    tasks = [(config, None, seed) for seed in range(5)
+             for config in (gsp, vcg)]
+    groups = []
+    def run_all(func, task_groups):
+        groups.extend(task_groups)
+        return [[seed for (_, _, seed) in group] for group in task_groups]
+
+    results = lockstep_map(run_all, 3)(run_task, tasks)
+    assert results == [seed for (_, _, seed) in tasks]
+    assert [len(group) for group in groups] == [3, 2, 3, 2]
+    for group in groups:
+        assert len(set(id(config) for (config, _, _) in group)) == 1
+
+def test_profile_puts_copy_back():
+    from optparse import Values
+    from auction import sim, load_modules
+    from profiler import SimProfile
+
+    class Crashes:
+        def __init__(self, id, value, budget):
+            self.id = id
+        def initial_bid(self, reserve):
+            return reserve
+        def bid(self, t, history, reserve):
+            raise RuntimeError("bad agent")
+
+    names = ['Truthful', 'Crashes']
+    classes = load_modules(['Truthful'])
+    classes['Crashes'] = Crashes
+    config = Values(dict(
+        mechanism='gsp', num_rounds=4, budget=20000, reserve=0,
+        click_period=48, click_file=None, dropoff=0.75,
+        history_store='lists', agent_class_names=names,
+        agent_classes=classes, agent_values=[50, 60],
+        profiler=SimProfile()))
+    (real_copy, real_deepcopy) = (copy.copy, copy.deepcopy)
+    with pytest.raises(RuntimeError):
+        sim(config)
+    assert copy.copy is real_copy
+    assert copy.deepcopy is real_deepcopy
+
+def test_notify_observers():
+    from auction import notify_observers
+
+    class Watcher:
+        def __init__(self, id):
+            self.id = id
+            self.seen = []
+        def observe(self, t, result):
+            self.seen.append((t, result))
+
+    watchers = [Watcher(id) for id in range(3)]
+    bids = [(0, 10), (1, 30), (2, 20)]
+    notify_observers(watchers, 4, bids, [1, 2], [8, 6], [160, 60])
+    (t, result) = watchers[1].seen[0]
+    assert t == 4
+    assert (result.slot, result.clicks, result.payment) == (0, 8, 160)
+    assert result.bids == ((0, 10), (1, 30), (2, 20))
+    assert result.slot_clicks == (8, 6)
+    (t, result) = watchers[0].seen[0]
+    assert (result.slot, result.clicks, result.payment) == (None, 0, 0)
+    assert watchers[2].seen[0][1].payment == 60
@@ -120,3 +120,60 @@ def test_bb_overbid():
     # bid for slot 2 = value = 8
     assert a1.bid(t, history, reserve) == 8
 
+
+def test_market_bid():
+    # Bidding from the simulator's shared snapshot gives the same answer
+    # as bidding from the history alone.
+    from market import MarketSnapshot
+    budget = 1000
+    t = 1
+    reserve = 0
+    history = History([[(3, 10), (2, 5), (1, 4)]], [[3, 2, 1]], [[3, 2, 0]],
+                      [[5, 4, 0]], [[15, 8, 0]])
+    market = MarketSnapshot(t, history, reserve, {1: 0, 2: 8, 3: 15})
+    assert market.thresholds == (10, 5, 4)
+    assert market.bid_ranges(3) == [(5, None), (4, 5), (0, 4)]
+
+    # Every agent gets the same snapshot, so none of them can change it
+    spent = {1: 0, 2: 8, 3: 15}
+    market = MarketSnapshot(t, history, reserve, spent)
+    spent[3] = 0
+    assert market.spent[3] == 15
+    for change in [lambda: market.spent.update({3: 0}),
+                   lambda: market.spent.__setitem__(3, 0)]:
+        try:
+            change()
+            assert False
+        except TypeError:
+            pass
+    try:
+        market.thresholds = (0, 0, 0)
+        assert False
+    except AttributeError:
+        pass
+    assert market.spent[3] == 15 and market.thresholds == (10, 5, 4)
+
+    for (id, value) in [(1, 8), (2, 10), (3, 20)]:
+        a = BBAgent(id, value, budget)
+        assert a.market_bid(t, history, reserve, market) == \
+            a.bid(t, history, reserve)
+
+def test_bid_batch():
+    # One bid_batch call gives everyone the bid market_bid would
+    budget = 1000
+    t = 1
+    history = History([[(3, 10), (2, 5), (1, 4)]], [[3, 2, 1]], [[3, 2, 0]],
+                      [[5, 4, 0]], [[15, 8, 0]])
+    ids = [1, 2, 3]
+    values = [8, 10, 20]
+    for reserve in [0, 5]:
+        expected = [BBAgent(id, value, budget).bid(t, history, reserve)
+                    for (id, value) in zip(ids, values)]
+        assert BBAgent.bid_batch(ids, values, [budget] * 3, t, history,
+                                 reserve) == expected
+    # Fractional bids take the one at a time path
+    history = History([[(3, 10.5), (2, 5), (1, 4)]], [[3, 2, 1]],
+                      [[3, 2, 0]], [[5, 4, 0]], [[15, 8, 0]])
+    expected = [BBAgent(id, value, budget).bid(t, history, 0)
+                for (id, value) in zip(ids, values)]
+    assert BBAgent.bid_batch(ids, values, [budget] * 3, t, history, 0) == expected
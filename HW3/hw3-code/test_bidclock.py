@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+# http://pytest.org/
+# run py.test to run the tests (it magically finds things
+# called test_blah and runs them)
+
+import time
+
+from bidclock import BidClock, cpu_clock, format_bid_reports
+
+def slow_bid(b):
+    ## Burn CPU: waiting doesn't count against the deadline
+    start = cpu_clock()
+    while cpu_clock() - start < 0.05:
+        pass
+    return b
+
+def test_deadline():
+    for fallback in ['last', 'zero']:
+        clock = BidClock([0, 1], deadline=0.01, fallback=fallback)
+        try:
+            assert clock.bid(0, 0, lambda b: b, 30) == 30
+            late = clock.bid(1, 0, slow_bid, 40)
+            assert clock.bid(1, 1, lambda b: b, 50) == 50
+        finally:
+            clock.close()
+        assert late == (30 if fallback == 'last' else 0)
+        assert clock.timeouts == {0: 1, 1: 0}
+        assert len(clock.call_times[0]) == 2
+
+def test_waiting_is_free():
+    clock = BidClock([0], deadline=0.01)
+    try:
+        # Longer than the deadline, but not long enough to be interrupted
+        assert clock.bid(0, 0, lambda b: time.sleep(0.05) or b, 30) == 30
+    finally:
+        clock.close()
+    assert clock.timeouts == {0: 0}
+    assert clock.call_times[0][0] < 0.01
+
+def test_runaway_is_interrupted():
+    clock = BidClock([0], deadline=0.01)
+    start = time.time()
+    try:
+        assert clock.bid(0, 0, lambda b: time.sleep(5) or b, 30) == 0
+    finally:
+        clock.close()
+    assert time.time() - start < 1
+    assert clock.timeouts == {0: 1}
+
+def test_time_budget():
+    clock = BidClock([0], time_budget=0.01)
+    assert clock.bid(0, 0, slow_bid, 30) == 30
+    assert clock.exhausted == {0: 0}
+    # Not called any more
+    assert clock.bid(1, 0, lambda b: 1 / 0, 40) == 30
+    assert len(clock.call_times[0]) == 1
+    lines = format_bid_reports([clock.report()], ['Truthful'])
+    assert lines[1].split()[:3] == ['0', 'Truthful', '1']
+    assert lines[1].split()[-2:] == ['0', '1']
@@ -0,0 +1,44 @@
+#!/usr/bin/env python
+
+# http://pytest.org/
+# run py.test to run the tests (it magically finds things
+# called test_blah and runs them)
+
+import math
+
+from clickmodel import ClickModel
+from util import iround
+
+def test_diurnal():
+    model = ClickModel.diurnal(48, 3, 0.75)
+    assert model.num_rounds == 48
+    assert model.clicks(0) == (80, 60, 45)
+    assert model.clicks(24) == (20, 15, 11)
+    for t in range(48):
+        top = iround(30*math.cos(math.pi*t/24) + 50)
+        assert model.clicks(t) == tuple(iround(top * pow(0.75, i))
+                                        for i in range(3))
+        assert model.round_clicks(t) == sum(model.clicks(t))
+    assert model.total_clicks() == sum(model.round_clicks(t)
+                                       for t in range(48))
+
+def test_period():
+    model = ClickModel.diurnal(48, 2, 0.5, period=24)
+    assert model.clicks(0) == model.clicks(24) == (80, 40)
+    assert model.clicks(12) == (20, 10)
+
+def test_cache_is_bounded():
+    from optparse import Values
+    ClickModel._cache.clear()
+    configs = [Values(dict(click_file=None, click_period=48, num_rounds=48,
+                           dropoff=0.5 + 0.01 * k))
+               for k in range(ClickModel.CACHE_SIZE + 5)]
+    first = ClickModel.for_config(configs[0], 3)
+    assert ClickModel.for_config(configs[0], 3) is first
+    for config in configs:
+        ClickModel.for_config(config, 3)
+    assert len(ClickModel._cache) == ClickModel.CACHE_SIZE
+    # The oldest were evicted, the newest are still there
+    assert ClickModel.for_config(configs[0], 3) is not first
+    last = ClickModel.for_config(configs[-1], 3)
+    assert ClickModel.for_config(configs[-1], 3) is last
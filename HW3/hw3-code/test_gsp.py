@@ -4,7 +4,7 @@
 # run py.test to run the tests (it magically finds things
 # called test_blah and runs them)
 
-from gsp import GSP
+from gsp import GSP, SlotPriceIndex
 
 def test_mechanism():
     num_slots = 4
@@ -71,3 +71,68 @@ def test_bid_ranges():
     assert bid_range(0, reserve) == (22, None)
     assert bid_range(1, reserve) == (22, 22)
     assert bid_range(2, reserve) == (22, 22)
+
+
+def test_compute_batch():
+    import pytest
+    numpy = pytest.importorskip("numpy")
+
+    slot_clicks = [1] * 4
+    bids = [10, 12, 18, 14, 20]
+    ids = range(1, 6)
+    # One auction per row; the same bids in different column orders
+    batch = numpy.array([bids, bids[::-1], [1, 2, 30, 4, 3]])
+
+    for reserve in [0, 11, 14, 15, 19, 22]:
+        (alloc, payments) = GSP.compute_batch(slot_clicks, reserve, batch)
+        assert alloc.shape == payments.shape == (3, 4)
+        for (row, row_bids) in enumerate(batch):
+            (e_alloc, e_payments) = GSP.compute(
+                slot_clicks, reserve, zip(ids, row_bids))
+            k = len(e_alloc)
+            assert [ids[j] for j in alloc[row, :k]] == e_alloc
+            assert list(payments[row, :k]) == e_payments
+            assert list(alloc[row, k:]) == [-1] * (4 - k)
+            assert list(payments[row, k:]) == [0] * (4 - k)
+
+
+def old_bid_range(slot, reserve, bids):
+    """bid_range_for_slot as it was before SlotPriceIndex: filter, sort,
+    and reverse the bids on every call"""
+    bid_amounts = [b for (_, b) in bids if b >= reserve]
+    bid_amounts.sort()
+    bid_amounts.reverse()
+
+    n = len(bid_amounts)
+    if slot >= n:
+        if n > 0:
+            max_bid = bid_amounts[-1]
+        else:
+            max_bid = reserve if slot > 0 else None
+        return (reserve, max_bid)
+
+    min_bid = bid_amounts[slot]
+    max_bid = bid_amounts[slot-1] if slot > 0 else None
+    return (min_bid, max_bid)
+
+def test_slot_price_index():
+    bids = zip(range(1,6), [10, 12, 18, 14, 20])
+
+    index = SlotPriceIndex(0, bids)
+    assert index.bid_ranges(6) == [(20, None), (18, 20), (14, 18), (12, 14),
+                                   (10, 12), (0, 10)]
+    assert index.bid_ranges(5, exclude=3) == [(20, None), (14, 20), (12, 14),
+                                              (10, 12), (0, 10)]
+    index = SlotPriceIndex(15, bids)
+    assert index.bid_ranges(4) == [(20, None), (18, 20), (15, 18), (15, 18)]
+    assert SlotPriceIndex(22, bids).bid_ranges(2) == [(22, None), (22, 22)]
+
+    for reserve in [0, 11, 15, 22]:
+        index = SlotPriceIndex(reserve, bids)
+        for slot in range(7):
+            assert index.bid_range(slot) == old_bid_range(slot, reserve, bids)
+        # Leaving an agent out is the same as filtering out its bid
+        for a_id in range(0, 7):
+            others = [(a, b) for (a, b) in bids if a != a_id]
+            expected = [old_bid_range(s, reserve, others) for s in range(7)]
+            assert index.bid_ranges(7, exclude=a_id) == expected
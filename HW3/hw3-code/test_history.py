@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+
+# http://pytest.org/
+# run py.test to run the tests (it magically finds things
+# called test_blah and runs them)
+
+from history import History
+
+def make_history():
+    bids = {0: [(0, 10), (1, 5), (2, 4)]}
+    occupants = {0: [0, 1]}
+    slot_clicks = {0: [3, 2]}
+    per_click_payments = {0: [5, 4]}
+    slot_payments = {0: [15, 8]}
+    return History(bids, occupants, slot_clicks,
+                   per_click_payments, slot_payments)
+
+def test_round_is_cached():
+    history = make_history()
+    r = history.round(0)
+    assert history.round(0) is r
+    assert r.bids == ((0, 10), (1, 5), (2, 4))
+    assert r.occupants.index(1) == 1
+    assert sum(r.slot_payments) == 23
+    assert history.num_rounds() == 1
+    assert history.last_round() == 0
+
+def test_round_is_read_only():
+    history = make_history()
+    r = history.round(0)
+    try:
+        r.clicks = [100, 100]
+        assert False, "expected AttributeError"
+    except AttributeError:
+        pass
+    try:
+        r.clicks[0] = 100
+        assert False, "expected TypeError"
+    except TypeError:
+        pass
+    assert history.round(0).clicks == (3, 2)
+
+def test_price_index_is_shared_and_read_only():
+    import pytest
+    history = make_history()
+    index = history.price_index(0, 0)
+    assert history.price_index(0, 0) is index
+    assert index.bid_range(0) == (10, None)
+    # Agents share it, so nobody gets to change it for the others
+    with pytest.raises(AttributeError):
+        index.amounts.reverse()
+    with pytest.raises(TypeError):
+        index.rank[0] = 2
+    with pytest.raises(AttributeError):
+        index.amounts = (4, 5, 10)
+    assert history.price_index(0, 0).bid_range(0) == (10, None)
+    # The cache is on the history, not on the frozen round
+    assert not hasattr(history.round(0), '_price_indexes')
+
+def test_list_backed_history():
+    history = History([[(3, 10), (2, 5)]], [[3, 2]], [[3, 2]],
+                      [[5, 0]], [[15, 0]])
+    assert history.round(0).bids == ((3, 10), (2, 5))
+    assert history.num_rounds() == 1
+
+def test_columnar_history_matches_lists():
+    import pytest
+    pytest.importorskip("numpy")
+    from history import ColumnarHistory
+    from stats import Stats
+
+    lists = History({}, {}, {}, {}, {}, 3)
+    columnar = ColumnarHistory(2, 2, [0, 1, 2])
+    rounds = [
+        ([(0, 10), (1, 5.5), (2, 4)], [0, 1], [3, 2], [5.5, 4], [16.5, 8]),
+        ([(0, 3), (1, 0), (2, 0)], [0], [3, 2], [0], [0]),
+        ]
+    for (t, r) in enumerate(rounds):
+        lists.record_round(t, *r)
+        columnar.record_round(t, *r)
+
+    assert columnar.num_rounds() == 2
+    for t in range(2):
+        a = lists.round(t)
+        b = columnar.round(t)
+        assert a.bids == b.bids
+        assert a.occupants == b.occupants
+        assert a.clicks == b.clicks
+        assert a.per_click_payments == b.per_click_payments
+        assert a.slot_payments == b.slot_payments
+    # ints stay ints
+    assert isinstance(columnar.round(0).bids[0][1], int)
+
+    values = {0: 10, 1: 6, 2: 4}
+    for id in range(3):
+        assert (Stats(lists, values).total_utility(id) ==
+                Stats(columnar, values).total_utility(id))
+    assert Stats(lists, values).total_revenue() == \
+        Stats(columnar, values).total_revenue()
+    for t in range(2):
+        for id in range(3):
+            assert (repr(columnar.spent_through(id, t)) ==
+                    repr(lists.spent_through(id, t)))
+        assert repr(columnar.revenue_through(t)) == repr(lists.revenue_through(t))
+
+def test_running_totals():
+    histories = [History({}, {}, {}, {}, {}, 3)]
+    try:
+        from history import ColumnarHistory
+        histories.append(ColumnarHistory(3, 2, [0, 1, 2]))
+    except ImportError:
+        pass
+
+    rounds = [
+        ([(0, 10), (1, 5), (2, 4)], [0, 1], [3, 2], [5, 4], [15, 8]),
+        ([(0, 3), (1, 0), (2, 4)], [2, 0], [3, 2], [3, 0], [9, 0]),
+        ([(0, 3), (1, 9), (2, 4)], [1, 2], [4, 1], [4, 3], [16, 3]),
+        ]
+    for history in histories:
+        for (t, r) in enumerate(rounds):
+            history.record_round(t, *r)
+
+        assert history.spent_through(0, -1) == 0
+        assert history.spent_through(0, 0) == 15
+        assert history.spent_through(0, 2) == 15
+        assert history.spent_through(2, 1) == 9
+        assert history.spent_through(2, 2) == 12
+        assert history.agent_clicks_through(0, 2) == 5
+        assert history.agent_clicks_through(1, 2) == 6
+        assert history.clicks_through(-1) == 0
+        assert history.clicks_through(1) == 10
+        assert history.clicks_through(2) == 15
+        assert history.revenue_through(2) == 51
+        # Sums of int payments are ints, in every store
+        assert isinstance(history.spent_through(0, 2), int)
+        assert isinstance(history.revenue_through(2), int)
+
+    # Hand-built histories work too
+    history = History([r[0] for r in rounds], [r[1] for r in rounds],
+                      [r[2] for r in rounds], [r[3] for r in rounds],
+                      [r[4] for r in rounds])
+    assert history.spent_through(2, 2) == 12
+    assert history.revenue_through(1) == 32
+
+def test_summarize():
+    from stats import Stats
+    values = {0: 10, 1: 6, 2: 5}
+    rounds = [
+        ([(0, 10), (1, 5), (2, 4)], [0, 1], [3, 2], [5, 4], [15, 8]),
+        ([(0, 3), (1, 0), (2, 4)], [2, 0], [3, 2], [3, 0], [9, 0]),
+        ]
+    recorded = History({}, {}, {}, {}, {}, 3)
+    for (t, r) in enumerate(rounds):
+        recorded.record_round(t, *r)
+    hand_built = History([r[0] for r in rounds], [r[1] for r in rounds],
+                         [r[2] for r in rounds], [r[3] for r in rounds],
+                         [r[4] for r in rounds])
+
+    for history in [recorded, hand_built]:
+        stats = Stats(history, values)
+        summary = stats.summarize()
+        assert summary['utility'] == {0: 35, 1: 4, 2: 6}
+        for id in values:
+            assert summary['utility'][id] == stats.total_utility(id)
+        assert summary['clicks'] == {0: 5, 1: 2, 2: 3}
+        assert summary['spent'] == {0: 15, 1: 8, 2: 9}
+        assert summary['revenue'] == stats.total_revenue() == 32
+
+def test_summary_history():
+    from history import SummaryHistory
+    from stats import Stats
+    history = SummaryHistory(2, 2)
+    for t in range(10):
+        history.record_round(t, [(0, 5), (1, 3)], [0, 1], [2, 1], [3, 1],
+                             [6, 1])
+
+    assert history.num_rounds() == 10
+    assert history.round(9).bids == ((0, 5), (1, 3))
+    assert history.round(8).clicks == (2, 1)
+    for old in [0, 7]:
+        try:
+            history.round(old)
+            assert False, "expected KeyError"
+        except KeyError:
+            pass
+    assert history.spent_through(0, 9) == 60
+    assert history.spent_through(1, 8) == 9
+    assert history.clicks_through(9) == 30
+
+    summary = Stats(history, {0: 5, 1: 3}).summarize()
+    assert summary['utility'] == {0: 40, 1: 20}
+    assert summary['spent'] == {0: 60, 1: 10}
+    assert summary['clicks'] == {0: 20, 1: 10}
+    assert summary['revenue'] == 70
+
+def test_summary_history_window():
+    import pytest
+    from history import SummaryHistory, RoundNotKept
+    history = SummaryHistory(3, 2)
+    for t in range(7):
+        history.record_round(t, [(0, t), (1, 3)], [0, 1], [2, 1], [3, 1],
+                             [6, 1])
+
+    assert [history.round(t).bids[0][1] for t in [4, 5, 6]] == [4, 5, 6]
+    for old in [0, 3]:
+        try:
+            history.round(old)
+            assert False, "expected KeyError"
+        except KeyError:
+            pass
+    with pytest.raises(RoundNotKept) as excinfo:
+        history.spent_through(0, 2)
+    assert "--history-window" in str(excinfo.value)
+    ## Totals through rounds in the window still cover every round
+    assert history.spent_through(0, 4) == 30
+    assert history.agent_clicks_through(1, 6) == 7
+    assert history.average_price_through(6) == 49 / 21.0
+
+def test_values_stay_out_of_history():
+    ## Utilities plus payments over clicks would give away every agent's
+    ## value, so no history keeps them
+    from history import SummaryHistory
+    histories = [History({}, {}, {}, {}, {}, 2), SummaryHistory(2, 2)]
+    try:
+        from history import ColumnarHistory
+        histories.append(ColumnarHistory(1, 2, [0, 1]))
+    except ImportError:
+        pass
+    for history in histories:
+        history.record_round(0, [(0, 5), (1, 3)], [0, 1], [2, 1], [3, 1],
+                             [6, 1])
+        for name in dir(history):
+            assert 'utilit' not in name
+
+def test_average_price_through():
+    history = History({}, {}, {}, {}, {}, 2)
+    assert history.average_price_through(-1) == 0.0
+    history.record_round(0, [(0, 0), (1, 0)], [], [2, 1], [], [])
+    assert history.average_price_through(0) == 0.0
+    history.record_round(1, [(0, 5), (1, 3)], [0, 1], [2, 1], [3, 1],
+                         [6, 1])
+    assert history.average_price_through(1) == 7 / 3.0
@@ -0,0 +1,25 @@
+#!/usr/bin/env python
+
+# http://pytest.org/
+# run py.test to run the tests (it magically finds things
+# called test_blah and runs them)
+
+from profiler import SimProfile, merge_reports, format_report
+
+def test_sim_profile():
+    prof = SimProfile()
+    prof.add_time('clearing', 0.5)
+    prof.add_time('clearing', 0.25)
+    double = prof.counting('double', lambda x: 2 * x)
+    assert double(3) == 6
+    assert double(4) == 8
+    report = prof.report()
+    assert report == {'times': {'clearing': 0.75},
+                      'counts': {'clearing': 2, 'double': 2}}
+
+    total = merge_reports([report, report])
+    assert total['times'] == {'clearing': 1.5}
+    assert total['counts'] == {'clearing': 4, 'double': 4}
+    lines = format_report(total, 2)
+    assert lines[1].split()[:4] == ['clearing', '1.5000', '100.0', '4']
+    assert lines[2].split() == ['double', '4']
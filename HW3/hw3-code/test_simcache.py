@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+# http://pytest.org/
+# run py.test to run the tests (it magically finds things
+# called test_blah and runs them)
+
+import os
+
+from simcache import SimCache
+
+def test_get_put(tmpdir):
+    cache = SimCache(str(tmpdir), 1024 * 1024)
+    key = SimCache.key(('Truthful', (10, 20), 5))
+    assert cache.get(key) is None
+    cache.put(key, ([1, 2], [3, 4], 5))
+    assert cache.get(key) == ([1, 2], [3, 4], 5)
+    assert (cache.hits, cache.misses) == (1, 1)
+    # Survives a restart
+    assert SimCache(str(tmpdir), 1024 * 1024).get(key) == ([1, 2], [3, 4], 5)
+
+def test_lru_eviction(tmpdir):
+    cache = SimCache(str(tmpdir), 1024 * 1024)
+    for k in range(3):
+        cache.put(str(k), "x" * 1000)
+        # mtimes might only have 1s resolution
+        os.utime(cache._path(str(k)), (k, k))
+    cache.get('0')
+    cache.max_bytes = cache._total
+    cache.put('3', "x" * 1000)
+    # '1' was least recently used
+    assert cache.get('1') is None
+    for key in ['0', '2', '3']:
+        assert cache.get(key) == "x" * 1000
+    assert len(os.listdir(str(tmpdir))) == 3
+
+def test_cached_map(tmpdir):
+    cache = SimCache(str(tmpdir), 1024 * 1024)
+    ran = []
+    def run_all(func, tasks):
+        ran.extend(tasks)
+        return map(func, tasks)
+    run = cache.cached_map(run_all, lambda x: SimCache.key(x))
+    square = lambda x: x * x
+    assert run(square, [1, 2, 3]) == [1, 4, 9]
+    assert run(square, [3, 4, 2]) == [9, 16, 4]
+    assert ran == [1, 2, 3, 4]
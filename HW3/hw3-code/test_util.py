@@ -0,0 +1,130 @@
+#!/usr/bin/env python
+
+# http://pytest.org/
+# run py.test to run the tests (it magically finds things
+# called test_blah and runs them)
+
+import itertools
+import math
+
+import pytest
+
+from util import (unrank_permutation, sample_permutations, class_groups,
+                  canonical_perm, num_assignments, class_assignments,
+                  sample_class_assignments, class_averages)
+
+def test_unrank_permutation():
+    l = ['a', 'b', 'c', 'd']
+    perms = [unrank_permutation(l, r) for r in range(24)]
+    assert perms == [list(p) for p in itertools.permutations(l)]
+
+def test_sample_permutations():
+    l = [5, 1, 9, 3, 7]
+    for stratify in [False, True]:
+        perms = list(sample_permutations(l, 60, stratify))
+        assert len(perms) == 60
+        assert all(sorted(p) == sorted(l) for p in perms)
+        # without replacement
+        assert len(set(map(tuple, perms))) == 60
+        if stratify:
+            tops = [p.index(9) for p in perms]
+            assert sorted(tops.count(i) for i in range(5)) == [12] * 5
+
+    # all of them
+    perms = list(sample_permutations(l, 120))
+    assert len(set(map(tuple, perms))) == 120
+
+    # repeated values: positions are still distinct
+    assert len(list(sample_permutations([1, 1, 2], 6, True))) == 6
+
+def test_class_assignments():
+    classes = ['Truthful', 'BB', 'Truthful', 'BB']
+    groups = class_groups(classes)
+    assert groups == [[0, 2], [1, 3]]
+    assert canonical_perm([1, 2, 3, 4], groups) == (3, 4, 1, 2)
+    # 4! / (2! 2!) distinct ways to split the values between the classes
+    assert num_assignments(groups) == 6
+
+    expected = set(canonical_perm(perm, groups)
+                   for perm in itertools.permutations([1, 2, 3, 4]))
+    assignments = list(class_assignments([1, 2, 3, 4], groups))
+    assert len(assignments) == 6
+    assert set(tuple(vals) for (vals, _) in assignments) == expected
+    assert all(count == 4 for (_, count) in assignments)
+
+def test_sample_class_assignments():
+    import random
+    groups = [[0, 2], [1, 3]]
+    rng = random.Random(3)
+    drawn = list(sample_class_assignments([1, 2, 3, 4], groups, 4, rng))
+    assert len(set(tuple(vals) for vals in drawn)) == 4
+    for vals in drawn:
+        assert tuple(vals) == canonical_perm(vals, groups)
+    # Repeated values still give k assignments, told apart by position
+    assert len(list(sample_class_assignments([5, 5, 5, 5], groups, 6))) == 6
+    with pytest.raises(ValueError):
+        list(sample_class_assignments([1, 2, 3, 4], groups, 7))
+
+def test_class_averages():
+    groups = [[0, 2], [1]]
+    assert class_averages([1, 5, 3], groups) == [2.0, 5.0, 2.0]
+
+def test_running_stats():
+    from util import RunningStats, mean, stddev
+    xs = [3.0, 1.5, 8.25, 4.0, 4.0, 10.0]
+    s = RunningStats()
+    assert s.stddev() == 0
+    assert s.ci_halfwidth() == float('inf')
+    for x in xs:
+        s.add(x)
+    assert s.n == 6
+    assert abs(s.mean() - mean(xs)) < 1e-12
+    assert abs(s.stddev() - stddev(xs)) < 1e-12
+    sample_var = sum((x - mean(xs)) ** 2 for x in xs) / 5
+    assert abs(s.ci_halfwidth() - 1.96 * math.sqrt(sample_var / 6)) < 1e-12
+
+def test_running_stats_weights():
+    from util import RunningStats
+    weighted = RunningStats()
+    repeated = RunningStats()
+    for (x, w) in [(2.0, 3), (5.0, 1), (-1.0, 2)]:
+        weighted.add(x, w)
+        for k in range(w):
+            repeated.add(x)
+    assert weighted.n == repeated.n == 6
+    assert abs(weighted.mean() - repeated.mean()) < 1e-12
+    assert abs(weighted.stddev() - repeated.stddev()) < 1e-12
+    assert abs(weighted.stderr() - repeated.stderr()) < 1e-12
+
+def test_golden_section_max():
+    from util import golden_section_max
+    calls = []
+    def f(x):
+        calls.append(x)
+        return -(x - 37.0) ** 2
+    best = golden_section_max(f, 0, 100, tol=0.5)
+    assert abs(best - 37) < 0.5
+    assert len(calls) == len(set(calls))
+
+def test_percentile():
+    from util import percentile
+    xs = range(1, 11)
+    assert percentile(xs, 50) == 5
+    assert percentile(xs, 90) == 9
+    assert percentile(xs, 100) == 10
+    assert percentile(xs, 0) == 1
+    assert percentile([], 50) == 0
+
+def test_frozen_dict():
+    import copy
+    import pickle
+    import pytest
+    from util import FrozenDict
+    d = FrozenDict({1: 2})
+    assert d[1] == 2
+    for change in [lambda: d.__setitem__(1, 3), lambda: d.update({2: 3}),
+                   lambda: d.pop(1), d.clear]:
+        with pytest.raises(TypeError):
+            change()
+    assert d == {1: 2}
+    assert copy.deepcopy(d) == pickle.loads(pickle.dumps(d)) == d
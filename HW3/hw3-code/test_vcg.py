@@ -86,3 +86,49 @@ def test_bid_ranges():
     assert bid_range(0, reserve) == (22, None)
     assert bid_range(1, reserve) == (22, 22)
     assert bid_range(2, reserve) == (22, 22)
+
+
+def test_compute_batch():
+    import pytest
+    numpy = pytest.importorskip("numpy")
+
+    slot_clicks = [4,3,2,1]
+    bids = [10, 12, 18, 14, 20]
+    ids = range(1, 6)
+    batch = numpy.array([bids, bids[::-1], [1, 2, 30, 4, 3]])
+
+    for reserve in [0, 11, 14, 15, 19, 22]:
+        (alloc, payments) = VCG.compute_batch(slot_clicks, reserve, batch)
+        assert alloc.shape == payments.shape == (3, 4)
+        for (row, row_bids) in enumerate(batch):
+            (e_alloc, e_payments) = VCG.compute(
+                slot_clicks, reserve, zip(ids, row_bids))
+            k = len(e_alloc)
+            assert [ids[j] for j in alloc[row, :k]] == e_alloc
+            assert list(payments[row, :k]) == e_payments
+            assert list(alloc[row, k:]) == [-1] * (4 - k)
+
+
+def test_many_slots():
+    # Payments used to recurse once per slot; make sure a long slot list
+    # works and matches the closed form.
+    num_slots = 2000
+    slot_clicks = range(num_slots, 0, -1)
+    bids = zip(range(num_slots + 1), range(num_slots + 1))
+
+    (alloc, payments) = VCG.compute(slot_clicks, 0, bids)
+    assert alloc == range(num_slots, 0, -1)
+    # Every click difference is 1, so slot k pays the sum of the bids below
+    # it, per click: sum(range(num_slots - k)) / (num_slots - k)
+    for k in [0, 1, num_slots / 2, num_slots - 1]:
+        below = num_slots - k
+        assert payments[k] == sum(range(below)) / below
+
+def test_zero_click_slots():
+    # The sim gives tail slots no clicks once the dropoff rounds to 0
+    slot_clicks = [4, 2, 1, 0, 0]
+    bids = zip(range(6), [50, 40, 30, 20, 10, 5])
+
+    (alloc, payments) = VCG.compute(slot_clicks, 0, bids)
+    assert alloc == [0, 1, 2, 3, 4]
+    assert payments == [(2*40 + 1*30 + 1*20) / 4, (1*30 + 1*20) / 2, 20, 0, 0]
@@ -17,6 +17,16 @@ class Truthful:
     def bid(self, t, history, reserve):
         return self.value
 
+    @staticmethod
+    def bid_batch(ids, values, budgets, t, history, reserve):
+        """Bids for several agents in one auction (see auction.sim)"""
+        return list(values)
+
+    @staticmethod
+    def bid_many(agents, sims, t, histories, reserve, prev_bids):
+        """Bids for many agents at once (see lockstep.sim_lockstep)"""
+        return [a.value for a in agents]
+
     def __repr__(self):
         return "%s(id=%d, value=%d)" % (
             self.__class__.__name__, self.id, self.value)
@@ -4,6 +4,10 @@ import math
 import random
 from itertools import *
 
+def iround(x):
+    """Round x and return an int"""
+    return int(round(x))
+
 # argmax from
 # http://stackoverflow.com/questions/5098580/implementing-argmax-in-python
 
@@ -26,6 +30,160 @@ def shuffled(l):
     return x
 
 
+def unrank_permutation(l, rank):
+    """
+    Return the permutation of l with the given rank, 0 <= rank < len(l)!,
+    counting permutations of positions in lexicographic order.
+    """
+    items = list(l)
+    perm = []
+    for i in range(len(items), 0, -1):
+        (index, rank) = divmod(rank, math.factorial(i - 1))
+        perm.append(items.pop(index))
+    return perm
+
+def sample_permutations(l, k, stratify=False, rng=random):
+    """
+    Lazily generate k distinct permutations of l, uniformly at random,
+    without replacement (permutations are distinct as rearrangements of
+    positions, so l may have repeated values).  Needs k <= len(l)!.
+
+    If stratify is true, the position of the largest value is spread as
+    evenly as possible over all the positions: each position gets it in
+    k / len(l) of the samples, rounded up or down at random.
+
+    Draws from rng, a random.Random (by default the module's stream).
+    """
+    n = len(l)
+    if k > math.factorial(n):
+        raise ValueError("can't draw %d distinct permutations of %d items"
+                         % (k, n))
+    if not stratify or n < 2:
+        seen = set()
+        while len(seen) < k:
+            rank = rng.randrange(math.factorial(n))
+            if rank not in seen:
+                seen.add(rank)
+                yield unrank_permutation(l, rank)
+        return
+
+    top = l.index(max(l))
+    rest = l[:top] + l[top+1:]
+    # Which position gets the top value, for each sample
+    (per_stratum, extra) = divmod(k, n)
+    positions = range(n) * per_stratum + rng.sample(range(n), extra)
+    rng.shuffle(positions)
+
+    seen = dict((p, set()) for p in range(n))
+    rest_perms = math.factorial(n - 1)
+    for p in positions:
+        while True:
+            rank = rng.randrange(rest_perms)
+            if rank not in seen[p]:
+                break
+        seen[p].add(rank)
+        perm = unrank_permutation(rest, rank)
+        perm.insert(p, l[top])
+        yield perm
+
+def class_groups(class_names):
+    """
+    Group agents by class.  Returns a list with, for each class (in order
+    of first appearance), the indices of the agents of that class.
+    """
+    groups = {}
+    order = []
+    for (i, name) in enumerate(class_names):
+        if name not in groups:
+            groups[name] = []
+            order.append(name)
+        groups[name].append(i)
+    return [groups[name] for name in order]
+
+def canonical_perm(vals, groups):
+    """
+    The representative of all the value assignments that differ from vals
+    only by swapping values between agents of the same class: within each
+    group, the values are handed out in decreasing order.
+    """
+    canon = list(vals)
+    for group in groups:
+        group_vals = sorted((vals[i] for i in group), reverse=True)
+        for (i, v) in zip(group, group_vals):
+            canon[i] = v
+    return tuple(canon)
+
+def num_assignments(groups):
+    """
+    How many ways there are to hand out one distinct value per agent to
+    the classes in groups, not counting swaps within a class (the
+    multinomial coefficient n! / (|g1|! |g2|! ...)).
+    """
+    count = math.factorial(sum(len(group) for group in groups))
+    for group in groups:
+        count /= math.factorial(len(group))
+    return count
+
+def _assignment_values(values, groups, chosen):
+    """Values in agent order, given the indices into values each group
+    gets: each class's values go to its agents in decreasing order."""
+    vals = [None] * len(values)
+    for (group, indices) in zip(groups, chosen):
+        group_vals = sorted((values[j] for j in indices), reverse=True)
+        for (i, v) in zip(group, group_vals):
+            vals[i] = v
+    return vals
+
+def class_assignments(values, groups):
+    """
+    Lazily generate every way to hand out values to the classes in groups,
+    once each, in the form canonical_perm gives.  Yields (values in agent
+    order, number of permutations of values it stands for).  Values are
+    told apart by position, so repeated values can give the same
+    assignment twice.
+    """
+    count = math.factorial(len(values)) / num_assignments(groups)
+    def choose(g, remaining):
+        if g == len(groups):
+            yield []
+            return
+        for indices in combinations(remaining, len(groups[g])):
+            rest = [j for j in remaining if j not in indices]
+            for tail in choose(g + 1, rest):
+                yield [indices] + tail
+    for chosen in choose(0, range(len(values))):
+        yield (_assignment_values(values, groups, chosen), count)
+
+def sample_class_assignments(values, groups, k, rng=random):
+    """
+    Lazily generate k distinct ways to hand out values to the classes in
+    groups, uniformly at random without replacement, drawing from rng.
+    Needs k <= num_assignments(groups).
+    """
+    n = len(values)
+    if k > num_assignments(groups):
+        raise ValueError("can't draw %d distinct assignments" % k)
+    # Each assignment comes from the same number of permutations, so
+    # drawing permutations and skipping assignments we've already seen
+    # is uniform over the rest.
+    seen = set()
+    while len(seen) < k:
+        perm = unrank_permutation(range(n), rng.randrange(math.factorial(n)))
+        chosen = tuple(tuple(sorted(perm[i] for i in group))
+                       for group in groups)
+        if chosen not in seen:
+            seen.add(chosen)
+            yield _assignment_values(values, groups, chosen)
+
+def class_averages(per_agent, groups):
+    """Replace each agent's number with the average over its class."""
+    averaged = list(per_agent)
+    for group in groups:
+        avg = sum(per_agent[i] for i in group) / float(len(group))
+        for i in group:
+            averaged[i] = avg
+    return averaged
+
 def mean(lst):
     """Throws a div by zero exception if list is empty"""
     return sum(lst) / float(len(lst))
@@ -35,3 +193,95 @@ def stddev(lst):
         return 0
     m = mean(lst)
     return math.sqrt(sum((x-m)*(x-m) for x in lst) / len(lst))
+
+def percentile(sorted_lst, p):
+    """
+    The p-th percentile (0 <= p <= 100) of an already sorted list, by the
+    nearest rank method.  0 for an empty list.
+    """
+    if len(sorted_lst) == 0:
+        return 0
+    rank = int(math.ceil(p / 100.0 * len(sorted_lst)))
+    return sorted_lst[max(rank, 1) - 1]
+
+def golden_section_max(f, lo, hi, tol=1):
+    """
+    Golden-section search for the x in [lo, hi] maximizing f, assuming f
+    is unimodal there.  Stops once the bracket is at most tol wide, and
+    returns the best x it evaluated.  f gets called about
+    log(float(hi - lo) / tol) / log(1.618) + 2 times, with no repeats.
+    """
+    invphi = (math.sqrt(5) - 1) / 2
+    seen = {}
+    def g(x):
+        if x not in seen:
+            seen[x] = f(x)
+        return seen[x]
+
+    (a, b) = (lo, hi)
+    c = b - invphi * (b - a)
+    d = a + invphi * (b - a)
+    while b - a > tol:
+        if g(c) >= g(d):
+            (b, d) = (d, c)
+            c = b - invphi * (b - a)
+        else:
+            (a, c) = (c, d)
+            d = a + invphi * (b - a)
+    return max(seen, key=lambda x: seen[x]) if seen else (lo + hi) / 2.0
+
+class FrozenDict(dict):
+    """
+    A dict that can't be changed once it's built, for data the simulator
+    hands to more than one agent.
+    """
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("read-only dict")
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+    def __reduce__(self):
+        return (FrozenDict, (dict(self),))
+
+class RunningStats:
+    """
+    Mean and variance of a stream of numbers, updated one number at a time
+    (Welford's algorithm), without keeping the numbers around.
+    """
+    def __init__(self):
+        self.n = 0
+        self._mean = 0.0
+        self._m2 = 0.0   # sum of squared differences from the mean
+
+    def add(self, x, weight=1):
+        """Add x, counted weight times"""
+        self.n += weight
+        delta = x - self._mean
+        self._mean += delta * weight / self.n
+        self._m2 += weight * delta * (x - self._mean)
+
+    def mean(self):
+        """Throws a div by zero exception if nothing has been added"""
+        if self.n == 0:
+            raise ZeroDivisionError("mean of no numbers")
+        return self._mean
+
+    def stddev(self):
+        """Population standard deviation, like stddev()"""
+        if self.n == 0:
+            return 0
+        return math.sqrt(self._m2 / self.n)
+
+    def stderr(self):
+        """
+        Standard error of the mean, from the sample variance.  Infinite
+        until there are at least two numbers.
+        """
+        if self.n < 2:
+            return float('inf')
+        return math.sqrt(self._m2 / (self.n - 1) / self.n)
+
+    def ci_halfwidth(self, z=1.96):
+        """Half the width of the (default 95%) normal confidence interval
+        on the mean."""
+        return z * self.stderr()
@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 
-import random
+try:
+    import numpy
+except ImportError:
+    # Only needed for compute_batch
+    numpy = None
 
 from gsp import GSP
 
@@ -28,48 +32,79 @@ class VCG:
 
         # The allocation is the same as GSP, so we filled that in for you...
         
-        valid = lambda (a, bid): bid >= reserve
-        valid_bids = filter(valid, bids)
-
-        rev_cmp_bids = lambda (a1, b1), (a2, b2): cmp(b2, b1)
-        # shuffle first to make sure we don't have any bias for lower or
-        # higher ids
-        random.shuffle(valid_bids)
-        valid_bids.sort(rev_cmp_bids)
-
         num_slots = len(slot_clicks)
+        # Only the top num_slots + 1 bids matter: the winners, and the
+        # first loser, who may set the last price.
+        valid_bids = GSP._top_bids(num_slots + 1, reserve, bids)
         allocated_bids = valid_bids[:num_slots]
         if len(allocated_bids) == 0:
             return ([], [])
         
         (allocation, just_bids) = zip(*allocated_bids)
 
-        # TODO: You just have to implement this function
-        def total_payment(k):
-            """
-            Total payment for a bidder in slot k.
-            """
-            c = slot_clicks
-            n = len(allocation)
+        # Total payment for the bidder in each slot, accumulated in one pass
+        # from the last slot up: the bidder in slot k pays what the last
+        # slot pays, plus (c[k] - c[k+1]) * b[k+1] for each slot below it.
+        c = slot_clicks
+        n = len(allocation)
+        if len(valid_bids) > n:
+            last_price = max(reserve, valid_bids[n][1])
+        else:
+            last_price = reserve
 
-            # TODO: Compute the payment and return it.
-            if k == n - 1:
-                try:
-                    return c[k] * max(reserve, valid_bids[k+1][1])
-                except:
-                    return c[k] * reserve
-            elif k < n - 1:
-                return (c[k] - c[k+1]) * just_bids[k+1] + total_payment(k+1)
+        total_payments = [0] * n
+        total_payments[n-1] = c[n-1] * last_price
+        for k in range(n-2, -1, -1):
+            total_payments[k] = ((c[k] - c[k+1]) * just_bids[k+1] +
+                                 total_payments[k+1])
 
         def norm(totals):
-            """Normalize total payments by the clicks in each slot"""
-            return map(lambda (x,y): x/y, zip(totals, slot_clicks))
+            """Normalize total payments by the clicks in each slot.  A slot
+            with no clicks costs nothing per click."""
+            return map(lambda (x,y): x/y if y > 0 else 0,
+                       zip(totals, slot_clicks))
 
-        per_click_payments = norm(
-            [total_payment(k) for k in range(len(allocation))])
+        per_click_payments = norm(total_payments)
         
         return (list(allocation), per_click_payments)
 
+    @staticmethod
+    def compute_batch(slot_clicks, reserve, bids, rng=None):
+        """
+        Clear many auctions at once.  See GSP.compute_batch for the
+        arguments and return value; the allocation is the same as GSP's.
+
+        Total payments are accumulated from the bottom slot up with a
+        reversed cumulative sum.  As in compute, per-click payments are
+        floored when bids and clicks are both ints.
+        """
+        (allocation, next_bids) = GSP._rank_batch(
+            len(slot_clicks), reserve, bids, rng)
+        num_slots = len(slot_clicks)
+        c = numpy.asarray(slot_clicks)
+        filled = allocation >= 0
+        num_filled = filled.sum(1)[:, None]
+
+        # The bidder in slot k pays for the clicks it takes from the one
+        # below: (c[k] - c[k+1]) * next_bids[k], plus the same for every
+        # lower slot.  The last filled slot pays c[k] * next_bids[k].
+        slots = numpy.arange(num_slots)
+        c_below = numpy.where(slots + 1 < num_filled,
+                              numpy.append(c[1:], 0), 0)
+        increments = numpy.where(filled, (c - c_below) * next_bids, 0)
+        totals = numpy.cumsum(increments[:, ::-1], axis=1)[:, ::-1]
+
+        clicks = numpy.broadcast_to(c, totals.shape)
+        safe_clicks = numpy.where(clicks > 0, clicks, 1)
+        if (numpy.issubdtype(totals.dtype, numpy.integer) and
+            numpy.issubdtype(c.dtype, numpy.integer)):
+            per_click_payments = totals // safe_clicks
+        else:
+            per_click_payments = totals / safe_clicks.astype(float)
+        per_click_payments = numpy.where(filled & (clicks > 0),
+                                         per_click_payments, 0)
+        return (allocation, per_click_payments)
+
     @staticmethod
     def bid_range_for_slot(slot, slot_clicks, reserve, bids):
         """